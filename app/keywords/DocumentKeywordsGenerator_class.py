@@ -1,4 +1,29 @@
-from app.utils.ai_agent import initialize_agent, print_agent_usage
+import hashlib
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from strands import Agent
+
+from app.utils.ai_agent import (
+    add_usage,
+    initialize_agent,
+    invoke_agent,
+    print_agent_usage,
+    AWS_REGION,
+    KEYWORDS_MODEL,
+)
+
+# Output token cap of the keywords agent. Up to 50 keywords in the indented
+# JSON_FORMAT take about 1000 tokens; raise it when asking for more keywords.
+MAX_OUTPUT_TOKENS = 2048
+# Output token cap of a batched call (MAX_OUTPUT_TOKENS per document, up to this)
+BATCH_MAX_OUTPUT_TOKENS = 8192
+
+# Code fence the agent may wrap the JSON in
+JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.MULTILINE)
 
 JSON_FORMAT = """
 [
@@ -13,49 +38,230 @@ JSON_FORMAT = """
 ]
 """
 
+# Instructions shared by the single-document and the batched prompt, sent as the
+# (cached) system prompt of the agent
+KEYWORDS_INSTRUCTIONS = f"""You are a helpful assistant that generates list of keywords from the document. Your expertise is in security and ISO 27001 compliance.
+                You are given a document and you need to generate a list of keywords that are relevant to the document.    
+                The list will be used to assing appriopriate controls to the document.
+                The list you will return will be in JSON format.
+                The JSON format will be like thi
+                {JSON_FORMAT}
+                The keywords should be one word keywords. THe percentage matching should be a number between 0 and 1. 
+                The percentage is your serteninty how keyword matches the document.
+                Return up to 50 keywords but focus on the relevant keywords to security and ISO 27001 compliance and ommit general keywords.
+                Do not repeat keywords."""
+
+
+def hash_text(text: str) -> str:
+    """Return a short content hash of a text."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Keywords cached with other instructions are not reused
+KEYWORDS_INSTRUCTIONS_HASH = hash_text(KEYWORDS_INSTRUCTIONS)
+
+
+class KeywordsCache:
+    """
+    Persistent SQLite cache of generated keywords.
+
+    Keywords are keyed by the model, the instructions and the document content, so an
+    identical document is never sent to the agent twice. Safe to use from several threads.
+    """
+
+    def __init__(self, path: str, model_name: str = KEYWORDS_MODEL):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS keywords (
+                    model TEXT NOT NULL,
+                    prompt_hash TEXT NOT NULL,
+                    document_hash TEXT NOT NULL,
+                    keywords BLOB NOT NULL,
+                    PRIMARY KEY (model, prompt_hash, document_hash)
+                )"""
+            )
+
+    def get(self, document: str) -> Optional[List[Dict]]:
+        """Return the cached keywords of a document, or None if not cached."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT keywords FROM keywords"
+                " WHERE model = ? AND prompt_hash = ? AND document_hash = ?",
+                (self.model_name, KEYWORDS_INSTRUCTIONS_HASH, hash_text(document)),
+            ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, document: str, keywords: List[Dict]) -> None:
+        """Store the keywords of a document."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO keywords VALUES (?, ?, ?, ?)",
+                (
+                    self.model_name,
+                    KEYWORDS_INSTRUCTIONS_HASH,
+                    hash_text(document),
+                    orjson.dumps(keywords),
+                ),
+            )
+
 
 class DocumentKeywordsGenerator:
-    def __init__(self):
-        self._agent = initialize_agent()
+    def __init__(self, cache_path: Optional[str] = None):
+        """
+        Args:
+            cache_path: SQLite file caching the generated keywords by document content.
+                If None, keywords are always generated by the agent.
+        """
+        self._cache = KeywordsCache(cache_path) if cache_path else None
+        self._usage: Dict[str, int] = {}  # Token usage accumulated over all calls
+        self._usage_lock = threading.Lock()
+
+    @staticmethod
+    def _create_agent(max_tokens: int = MAX_OUTPUT_TOKENS) -> Agent:
+        """
+        Create an agent with a fresh conversation on the shared keywords BedrockModel.
+
+        Every call gets its own agent, so documents are not sent again as context of
+        the following calls and one generator can be used from several threads.
+
+        Args:
+            max_tokens: Output token cap of the agent
+        Returns:
+            Agent instance with the keywords instructions as a cached system prompt
+        """
+        return initialize_agent(
+            KEYWORDS_MODEL,
+            AWS_REGION,
+            max_tokens=max_tokens,
+            system_prompt=KEYWORDS_INSTRUCTIONS,
+        )
 
-    def generate_keywords(self, document: str) -> str:
+    def generate_keywords(self, document: str) -> List[Dict]:
         """
         Generate a list of keywords from the document.
 
         Args:
             document: The document to generate keywords from
         Returns:
-            A string of the JSON format of the keywords
+            The keywords, a list of {"word": ..., "matching": ...} dictionaries
+        Raises:
+            orjson.JSONDecodeError: If the agent response is not valid JSON
         """
+        if self._cache is not None:
+            keywords = self._cache.get(document)
+            if keywords is not None:
+                return keywords
 
-        result_agent = self._agent(
-            f"""You are a helpful assistant that generates list of keywords from the document. Your expertise is in security and ISO 27001 compliance.
-                You are given a document and you need to generate a list of keywords that are relevant to the document.    
-                The list will be used to assing appriopriate controls to the document.
-                The list you will return will be in JSON format.
-                The JSON format will be like thi
-                {JSON_FORMAT}
-                The keywords should be one word keywords. THe percentage matching should be a number between 0 and 1. 
-                The percentage is your serteninty how keyword matches the document.
-                Return up to 50 keywords but focus on the relevant keywords to security and ISO 27001 compliance and ommit general keywords.
-                Do not repeat keywords.
-
-                Return the JSON format only, no other text.
+        result_agent = self._invoke_agent(
+            self._create_agent(),
+            f"""Return the JSON format only, no other text.
             
             Generate a list of keywords from the following document:
             The document is:
-            {document}"""
+            {document}""",
         )
         # keywords is an AgentResult object and I need it as a text
         # message is a TypedDict, so access it as a dictionary
         # Use the __str__ method which properly extracts text from content blocks
         pure_agent_response = str(result_agent).strip()
         # response is a json string but I want only content of the json without the ```json and ```
-        pure_agent_response = pure_agent_response.replace("```json", "").replace(
-            "```", ""
+        pure_agent_response = JSON_FENCE_RE.sub("", pure_agent_response)
+        # convert the json string to a list of dictionaries
+        keywords = orjson.loads(pure_agent_response)
+        if self._cache is not None:
+            self._cache.set(document, keywords)
+        return keywords
+
+    def generate_keywords_batch(
+        self, documents: List[Tuple[str, str]]
+    ) -> Dict[str, List[Dict]]:
+        """
+        Generate the lists of keywords of several documents in a single agent call.
+
+        The instructions are sent once for all documents, each document is marked with
+        a "### doc_id=<id>" line and the agent returns one JSON object mapping the
+        document IDs to their keywords.
+
+        Args:
+            documents: List of (doc_id, document) tuples
+        Returns:
+            Dictionary mapping doc_id to its keywords (see generate_keywords).
+            Documents missing from the response are omitted, so callers can retry
+            them with generate_keywords.
+        Raises:
+            orjson.JSONDecodeError: If the agent response is not valid JSON
+            ValueError: If the agent response is not a JSON object
+        """
+        # Only documents without cached keywords are sent to the agent
+        cached: Dict[str, List[Dict]] = {}
+        if self._cache is not None:
+            for doc_id, document in documents:
+                keywords = self._cache.get(document)
+                if keywords is not None:
+                    cached[doc_id] = keywords
+            documents = [
+                (doc_id, document)
+                for doc_id, document in documents
+                if doc_id not in cached
+            ]
+            if not documents:
+                return cached
+
+        documents_text = "\n".join(
+            f"### doc_id={doc_id}\n{document}" for doc_id, document in documents
+        )
+        # The output cap of a batch grows with the number of documents
+        agent = self._create_agent(
+            min(MAX_OUTPUT_TOKENS * len(documents), BATCH_MAX_OUTPUT_TOKENS)
         )
-        # convert the json string to a dictionary
-        return pure_agent_response
+        result_agent = self._invoke_agent(
+            agent,
+            f"""You are given {len(documents)} documents, each one starts with a "### doc_id=<id>" line.
+                Generate the list of keywords for each document independently.
+                Return a single JSON object mapping every doc_id to its list of keywords in the JSON format of the instructions, for example:
+                {{"<doc_id>": [{{"word": "keyword1", "matching": 0.95}}]}}
+
+                Return the JSON object only, no other text.
+
+            The documents are:
+            {documents_text}""",
+        )
+        pure_agent_response = JSON_FENCE_RE.sub("", str(result_agent).strip())
+        keywords = orjson.loads(pure_agent_response)
+        if not isinstance(keywords, dict):
+            raise ValueError("Batched keywords response is not a JSON object")
+
+        results = dict(cached)
+        for doc_id, document in documents:
+            doc_keywords = keywords.get(doc_id)
+            if doc_keywords is None:
+                continue
+            results[doc_id] = doc_keywords
+            if self._cache is not None:
+                self._cache.set(document, doc_keywords)
+        return results
+
+    def _invoke_agent(self, agent: Agent, prompt: str):
+        """
+        Invoke an agent and add its token usage to the usage of the generator.
+
+        Args:
+            agent: Agent used for a single call
+            prompt: The prompt to send
+        Returns:
+            The agent result
+        """
+        try:
+            return invoke_agent(agent, prompt)
+        finally:
+            with self._usage_lock:
+                add_usage(self._usage, agent.event_loop_metrics.accumulated_usage)
 
     def print_agent_usage(self):
-        print_agent_usage(self.agent)
+        """
+        Print the agent usage statistics accumulated over all calls of the generator.
+        """
+        print_agent_usage(KEYWORDS_MODEL, self._usage)
@@ -1,9 +1,102 @@
 # generate list of keywords from the document using AI agent
 
+import hashlib
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from typing import Dict, List
+
+import orjson
+from strands.types.exceptions import MaxTokensReachedException
 from DocumentKeywordsGenerator_class import DocumentKeywordsGenerator
 
+# Number of documents sent to the agent in a single call
+BATCH_SIZE = 4
+# Estimated input tokens of a batch above which its documents are processed one by one
+MAX_INPUT_TOKENS = 50000
+# Number of batches processed at the same time; the calls wait on Bedrock, and
+# throttled calls are retried by the Bedrock client
+MAX_WORKERS = 8
+# SQLite file (in the keywords folder) caching the generated keywords by document content
+KEYWORDS_CACHE_FILENAME = ".keywords_cache.sqlite"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text (about 4 characters per token).
+    Args:
+        text: The text to estimate
+    Returns:
+        The estimated number of tokens
+    """
+    return len(text) // 4 + 1
+
+
+def get_keywords_meta_path(keywords_path: str) -> str:
+    """
+    Get the path of the sidecar file recording the source of a keywords file.
+    Args:
+        keywords_path: The keywords file (filename with path)
+    Returns:
+        The sidecar file path
+    """
+    return f"{keywords_path}.meta"
+
+
+def hash_file(path: str) -> str:
+    """
+    Hash the content of a file.
+    Args:
+        path: The file (filename with path)
+    Returns:
+        The BLAKE2b hex digest of the file content
+    """
+    with open(path, "rb") as file:
+        return hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+
+
+def is_keywords_up_to_date(document_path: str, keywords_path: str) -> bool:
+    """
+    Check if the keywords file was generated from the current document.
+    The document is hashed only if its modification time changed since then.
+    Args:
+        document_path: The document (filename with path)
+        keywords_path: The keywords file (filename with path)
+    Returns:
+        True if the keywords file exists and its sidecar matches the document
+    """
+    meta_path = get_keywords_meta_path(keywords_path)
+    try:
+        with open(meta_path, "rb") as file:
+            meta = orjson.loads(file.read())
+        if not os.path.exists(keywords_path):
+            return False
+        if meta["mtime_ns"] == os.stat(document_path).st_mtime_ns:
+            return True
+        if meta["blake2b"] != hash_file(document_path):
+            return False
+    except (OSError, ValueError, KeyError):
+        return False
+    # Touched but unchanged, record the new modification time
+    save_keywords_meta(document_path, keywords_path)
+    return True
+
+
+def save_keywords_meta(document_path: str, keywords_path: str) -> None:
+    """
+    Record the modification time and hash of the source document of a keywords file.
+    Args:
+        document_path: The document (filename with path)
+        keywords_path: The keywords file (filename with path)
+    """
+    meta = {
+        "mtime_ns": os.stat(document_path).st_mtime_ns,
+        "blake2b": hash_file(document_path),
+    }
+    with open(get_keywords_meta_path(keywords_path), "wb") as file:
+        file.write(orjson.dumps(meta))
+
 
 def read_document_from_file(document_name: str) -> str:
     """
@@ -21,18 +114,18 @@ def read_document_from_file(document_name: str) -> str:
         raise e
 
 
-def save_keywords_to_file(keywords_str: str, document_name: str) -> None:
+def save_keywords_to_file(keywords: List[Dict], document_name: str) -> None:
     """
     Save the keywords to a file.
     Args:
-        keywords_str: The keywords to save in JSON format (as string)
+        keywords: The keywords to save in JSON format
         document_name: The name of the document (filename with path)
     """
     try:
-        logging.debug(f"Saving keywords to file: {document_name}")
-        logging.debug(f"Keywords: {keywords_str}")
-        with open(f"{document_name}", "w") as file:
-            file.write(keywords_str)
+        logging.debug("Saving keywords to file: %s", document_name)
+        logging.debug("Keywords: %s", keywords)
+        with open(f"{document_name}", "wb") as file:
+            file.write(orjson.dumps(keywords, option=orjson.OPT_INDENT_2))
     except Exception as e:
         logging.error(f"Error saving keywords to file: {e}", exc_info=True)
         raise e
@@ -47,19 +140,104 @@ def process_document(document_name: str, doc_folder: str, keywords_folder: str)
         keywords_folder: The folder containing the keywords
     """
     document = read_document_from_file(f"{doc_folder}/{document_name}")
-    keywords_generator = DocumentKeywordsGenerator()
+    keywords_generator = DocumentKeywordsGenerator(
+        os.path.join(keywords_folder, KEYWORDS_CACHE_FILENAME)
+    )
     keywords = keywords_generator.generate_keywords(document)
-    save_keywords_to_file(keywords, f"{keywords_folder}/{document_name}.json")
+    keywords_path = f"{keywords_folder}/{document_name}.json"
+    save_keywords_to_file(keywords, keywords_path)
+    save_keywords_meta(f"{doc_folder}/{document_name}", keywords_path)
+
+
+def process_documents_batch(
+    document_names: List[str],
+    doc_folder: str,
+    keywords_folder: str,
+    keywords_generator: DocumentKeywordsGenerator,
+) -> None:
+    """
+    Process several documents with a single agent call and save their keywords.
+    Documents are processed one by one when the batch would exceed MAX_INPUT_TOKENS,
+    when the batched response reaches the output token cap, or when they are missing
+    from an invalid or incomplete batched response.
+    Args:
+        document_names: The names of the documents (filenames in doc_folder)
+        doc_folder: The folder containing the documents
+        keywords_folder: The folder containing the keywords
+        keywords_generator: The keywords generator to use
+    """
+    documents = [
+        (document_name, read_document_from_file(f"{doc_folder}/{document_name}"))
+        for document_name in document_names
+    ]
+
+    results: Dict[str, List[Dict]] = {}
+    if len(documents) > 1 and (
+        sum(estimate_tokens(document) for _, document in documents) <= MAX_INPUT_TOKENS
+    ):
+        try:
+            results = keywords_generator.generate_keywords_batch(documents)
+        except ValueError as e:
+            logging.warning(
+                "Invalid batched keywords response, processing documents one by one: %s",
+                e,
+            )
+        except MaxTokensReachedException:
+            logging.warning(
+                "Batched keywords response reached the output token cap, "
+                "processing documents one by one"
+            )
+
+    for document_name, document in documents:
+        keywords = results.get(document_name)
+        if keywords is None:
+            keywords = keywords_generator.generate_keywords(document)
+        keywords_path = f"{keywords_folder}/{document_name}.json"
+        save_keywords_to_file(keywords, keywords_path)
+        save_keywords_meta(f"{doc_folder}/{document_name}", keywords_path)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
     # filename = "149520415.md"
     doc_folder = "documents"
     keywords_folder = "documents_keywords"
 
     # process_document(filename, doc_folder, keywords_folder)
 
-    # list all files in the doc_folder
-    files = os.listdir(doc_folder)
-    for file in files:
-        process_document(file, doc_folder, keywords_folder)
+    # list all markdown files in the doc_folder, except those with up to date keywords
+    files = iter(
+        f
+        for f in os.listdir(doc_folder)
+        if f.endswith(".md")
+        and not is_keywords_up_to_date(
+            f"{doc_folder}/{f}", f"{keywords_folder}/{f}.json"
+        )
+    )
+    keywords_generator = DocumentKeywordsGenerator(
+        os.path.join(keywords_folder, KEYWORDS_CACHE_FILENAME)
+    )
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {}
+        while batch := list(islice(files, BATCH_SIZE)):
+            future = executor.submit(
+                process_documents_batch,
+                batch,
+                doc_folder,
+                keywords_folder,
+                keywords_generator,
+            )
+            futures[future] = batch
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(
+                    "Error processing documents %s: %s",
+                    futures[future],
+                    e,
+                    exc_info=True,
+                )
+
+    keywords_generator.print_agent_usage()
@@ -4,30 +4,37 @@ Document Selector class for selecting relevant documents for ISO 27001 controls.
 
 import logging
 import os
-from typing import Dict, List
+import re
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from app.utils.ai_agent import (
+    add_usage,
+    get_bedrock_model,
+    invoke_agent,
+    invoke_agent_async,
     print_agent_usage,
+    stream_agent,
     AWS_REGION,
-    CLAUDE_SONNET_4_5,
+    CACHE_POINT,
+    SELECTION_MODEL,
 )
 from app.selector.document_selector_utils import (
+    build_ranking_index,
     extract_document_metadata,
+    get_content_preview,
     get_control_name_from_path,
     read_control_file,
-    read_all_documents,
+    rank_documents,
+    read_all_documents_preview,
+    strip_markdown_fences_stream,
 )
 from strands import Agent, tool
-from strands.models.bedrock import BedrockModel
 from strands_tools import shell
 from strands_tools import file_read
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-MODEL_NAME = CLAUDE_SONNET_4_5
-
 OUTPUT_FORMAT = """
 # Selected Documents for ISO 27001 Control [CONTROL_NAME]
 
@@ -44,63 +51,135 @@ OUTPUT_FORMAT = """
 [Continue for 3-8 documents total]
 """
 
+# Static instructions sent as the (cached) system prompt of the agent
+SYSTEM_PROMPT = f"""You are a helpful assistant specialized in ISO 27001 compliance and information security. Your task is to select the most relevant documents for ISO 27001 controls.
+
+You have access to tools that can:
+- List all documents in the documents directory (_list_documents_tool)
+- Read full content of any document (_read_document_tool)
+- Read control files (_read_control_tool)
+
+You are given:
+1. A list of all available documents with their titles, filenames and URLs, and content previews of the documents most similar to the control
+2. An ISO 27001 control description (or several numbered control descriptions)
+
+If you need more detailed information about any document, including documents listed without a preview, you can use the _read_document_tool to read its full content.
+
+Your task, for each control:
+- Select 3-8 most important documents that are relevant to the ISO 27001 control
+- The number of documents should be based on how many documents are actually relevant (use fewer if there are fewer relevant documents)
+- Focus on documents that directly address the control requirements or support compliance with the control
+- Prioritize documents that are policies, procedures, or standards related to the control topic
+- Omit general documents that are not specifically relevant to this control
+
+Output format:
+The output for a control must be in markdown format exactly matching this structure:
+
+{OUTPUT_FORMAT}
+
+Requirements:
+- Start with the header: "# Selected Documents for ISO 27001 Control [CONTROL_NAME]"
+- Make sure you have inclued [CONTROL_NAME] in the header of the file in OUTPUT_FORMAT.
+- For each selected document, include:
+  - A numbered heading: "## [NUMBER]. [DOCUMENT_TITLE]"
+  - The Confluence URL: "**Confluence URL:** [URL]"
+  - 2-3 lines explaining why this document was selected and how it relates to the ISO control
+- Use the exact document titles and URLs provided
+- Number the documents sequentially starting from 1
+- Select between 3-8 documents (use fewer if fewer are relevant)
+- Focus on relevance to ISO 27001 compliance and security"""
+
+# Output token cap of a single-control selection; 8 document sections take about
+# 1500 tokens. Raise it (DocumentSelector max_output_tokens) to select more documents.
+MAX_OUTPUT_TOKENS = 2048
+# Output token cap of a batched selection (MAX_OUTPUT_TOKENS per control, up to this)
+BATCH_MAX_OUTPUT_TOKENS = 8192
+
+# Delimiters wrapped around every control section in a batched response
+BATCH_SECTION_RE = re.compile(
+    r"=== BEGIN CONTROL (\d+) ===\s*(.*?)\s*=== END CONTROL \1 ===", re.DOTALL
+)
+
 
 class DocumentSelector:
-    def __init__(self, documents_dir: str = "documents"):
+    def __init__(
+        self,
+        documents_dir: str = "documents",
+        model_id: str = SELECTION_MODEL,
+        max_output_tokens: int = MAX_OUTPUT_TOKENS,
+    ):
         """
         Initialize the DocumentSelector with an AI agent.
 
         Args:
             documents_dir: Path to the documents directory (default: "documents")
+            model_id: The Bedrock model ID used for the selection (default: SELECTION_MODEL)
+            max_output_tokens: Output token cap of a single-control selection
+                (default: MAX_OUTPUT_TOKENS), raise it when selecting many documents.
+                Calls reaching the cap raise MaxTokensReachedException.
         """
         self.documents_dir = documents_dir
-        self._agent = None  # Will be initialized by initialize_agent method
-
-    def _initialize_agent(self, control_path: str = None):
+        self.model_id = model_id
+        self.max_output_tokens = max_output_tokens
+        self._usage: Dict[str, int] = {}  # Token usage accumulated over all calls
+        # (key, rendered document list) of the latest documents, reused so the
+        # cached prompt prefix stays byte-identical across controls
+        self._documents_text_cache: Optional[Tuple[Tuple, str]] = None
+        # (key, ranking index) of the latest documents (see build_ranking_index)
+        self._ranking_index_cache: Optional[Tuple[Tuple, Dict]] = None
+
+    def initialize_agent(self) -> None:
         """
-        Initialize an agent with tools for reading documents from the documents directory.
-
-        Args:
-            control_path: Optional path to the control file. If provided, the agent
-                         will first read the control file.
-
-        Returns:
-            Initialized Agent instance with document reading tools
+        Create the shared BedrockModel of the selector up front instead of on the
+        first selection. Every call still gets its own agent (see _create_agent).
         """
         try:
             logger.info("Initializing DocumentSelector Agent...")
-            logger.info(f"Using model: {MODEL_NAME}")
+            logger.info(f"Using model: {self.model_id}")
             logger.info(f"Using AWS region: {AWS_REGION}")
             logger.info(f"Documents directory: {self.documents_dir}")
 
-            # Create BedrockModel
-            bedrock_model = BedrockModel(
-                model_id=MODEL_NAME,
-                region_name=AWS_REGION,
-            )
-
-            # Create tools for reading documents
-            tools = [
-                # self._list_documents_tool,
-                # self._read_document_tool,
-                # self._read_control_tool,
-                shell,
-                file_read,
-            ]
-
-            # Initialize agent with tools
-            agent = Agent(
-                model=bedrock_model,
-                tools=tools,
-            )
+            get_bedrock_model(self.model_id, AWS_REGION, self.max_output_tokens)
 
-            logger.info("Agent initialized successfully with document reading tools")
-            return agent
+            logger.info("Agent initialized successfully")
 
         except Exception as e:
             logger.error(f"Failed to initialize Agent: {str(e)}", exc_info=True)
             raise
 
+    def _create_agent(self, max_tokens: int = None) -> Agent:
+        """
+        Create an agent with a fresh conversation on a shared BedrockModel.
+
+        Every selection is an independent task, so each call gets its own agent:
+        earlier messages are not re-sent as context and concurrent calls do not
+        share conversation state. Creating an agent does not contact Bedrock.
+
+        Args:
+            max_tokens: Output token cap (default: max_output_tokens of the selector)
+
+        Returns:
+            Agent instance with document reading tools
+        """
+        # Create tools for reading documents
+        tools = [
+            # self._list_documents_tool,
+            # self._read_document_tool,
+            # self._read_control_tool,
+            shell,
+            file_read,
+        ]
+
+        # Initialize agent with tools and the static instructions as a cached system prompt
+        model = get_bedrock_model(
+            self.model_id, AWS_REGION, max_tokens or self.max_output_tokens
+        )
+        return Agent(
+            model=model,
+            tools=tools,
+            system_prompt=[{"text": SYSTEM_PROMPT}, CACHE_POINT],
+        )
+
     @tool
     def _list_documents_tool(self) -> List[str]:
         """
@@ -114,12 +193,10 @@ class DocumentSelector:
                 logger.warning(f"Documents directory not found: {self.documents_dir}")
                 return []
 
-            files = [
-                f
-                for f in os.listdir(self.documents_dir)
-                if f.endswith(".md")
-                and os.path.isfile(os.path.join(self.documents_dir, f))
-            ]
+            with os.scandir(self.documents_dir) as entries:
+                files = [
+                    e.name for e in entries if e.name.endswith(".md") and e.is_file()
+                ]
             logger.info(f"Listed {len(files)} documents")
             return files
         except Exception as e:
@@ -152,7 +229,7 @@ class DocumentSelector:
                 content = file.read()
 
             metadata = extract_document_metadata(content, filename)
-            logger.info(f"Read document: {filename}")
+            logger.debug("Read document: %s", filename)
             return metadata
         except Exception as e:
             logger.error(f"Error reading document {filename}: {e}", exc_info=True)
@@ -176,7 +253,7 @@ class DocumentSelector:
         """
         try:
             content = read_control_file(control_path)
-            logger.info(f"Read control file: {control_path}")
+            logger.debug("Read control file: %s", control_path)
             return content
         except Exception as e:
             logger.error(
@@ -200,10 +277,62 @@ class DocumentSelector:
             control_path: Path to the control file (optional if control_content provided)
             documents: List of dictionaries, each containing:
                 - filename: Document filename
-                - content: Full document content
+                - content: Full document content (or its preview)
                 - title: Document title
                 - url: Confluence URL
-                (optional if agent has tools to read documents)
+                (optional, the beginning of every document in the documents
+                directory is read if not provided)
+
+        Returns:
+            A markdown string with selected documents in the template format
+
+        Raises:
+            ValueError: If required parameters are missing
+            Exception: If agent fails to generate selection
+        """
+        control_name, prompt = self._prepare_selection(
+            control_content, control_name, control_path, documents
+        )
+
+        try:
+            logger.info(
+                f"Calling AI agent to select documents for control: {control_name}"
+            )
+            result_agent = self._invoke_agent(prompt)
+
+            pure_agent_response = self._clean_agent_response(
+                str(result_agent), control_name
+            )
+
+            logger.info(
+                f"Successfully generated document selection for control: {control_name}"
+            )
+            return pure_agent_response
+
+        except Exception as e:
+            logger.error(
+                f"Error selecting documents for control {control_name}: {e}",
+                exc_info=True,
+            )
+            raise
+
+    async def select_documents_async(
+        self,
+        control_content: str = None,
+        control_name: str = None,
+        control_path: str = None,
+        documents: List[Dict[str, str]] = None,
+        max_tokens: int = None,
+    ) -> str:
+        """
+        Asynchronous version of select_documents, calls for several controls can run concurrently.
+
+        Args:
+            control_content: The content of the ISO control file (optional if control_path provided)
+            control_name: The name of the ISO control (e.g., "5.18 Access rights")
+            control_path: Path to the control file (optional if control_content provided)
+            documents: List of document dictionaries (see select_documents)
+            max_tokens: Output token cap of the call (default: max_output_tokens)
 
         Returns:
             A markdown string with selected documents in the template format
@@ -212,10 +341,113 @@ class DocumentSelector:
             ValueError: If required parameters are missing
             Exception: If agent fails to generate selection
         """
-        # Initialize agent if not already initialized
-        if self._agent is None:
-            self._agent = self._initialize_agent(control_path)
+        control_name, prompt = self._prepare_selection(
+            control_content, control_name, control_path, documents
+        )
+
+        try:
+            logger.info(
+                f"Calling AI agent to select documents for control: {control_name}"
+            )
+            result_agent = await self._invoke_agent_async(prompt, max_tokens)
 
+            pure_agent_response = self._clean_agent_response(
+                str(result_agent), control_name
+            )
+
+            logger.info(
+                f"Successfully generated document selection for control: {control_name}"
+            )
+            return pure_agent_response
+
+        except Exception as e:
+            logger.error(
+                f"Error selecting documents for control {control_name}: {e}",
+                exc_info=True,
+            )
+            raise
+
+    async def select_documents_stream(
+        self,
+        control_content: str = None,
+        control_name: str = None,
+        control_path: str = None,
+        documents: List[Dict[str, str]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Select the most relevant documents for an ISO 27001 control, streaming the markdown.
+
+        Same as select_documents, but the markdown is yielded while the agent generates
+        it, so callers can write it out without waiting for the complete response.
+        The header is yielded before the agent is called, the agent only generates
+        the document sections.
+
+        Args:
+            control_content: The content of the ISO control file (optional if control_path provided)
+            control_name: The name of the ISO control (e.g., "5.18 Access rights")
+            control_path: Path to the control file (optional if control_content provided)
+            documents: List of document dictionaries (see select_documents)
+
+        Yields:
+            Chunks of the markdown with selected documents in the template format
+
+        Raises:
+            ValueError: If required parameters are missing
+            Exception: If agent fails to generate selection
+        """
+        control_name, prompt = self._prepare_selection(
+            control_content, control_name, control_path, documents, omit_header=True
+        )
+
+        yield f"# Selected Documents for ISO 27001 Control {control_name}\n\n"
+
+        try:
+            logger.info(
+                f"Streaming AI agent selection of documents for control: {control_name}"
+            )
+            agent = self._create_agent()
+            try:
+                chunks = strip_markdown_fences_stream(stream_agent(agent, prompt))
+                async for chunk in self._skip_header_stream(chunks):
+                    yield chunk
+            finally:
+                self._record_usage(agent)
+
+            logger.info(
+                f"Successfully generated document selection for control: {control_name}"
+            )
+
+        except Exception as e:
+            logger.error(
+                f"Error selecting documents for control {control_name}: {e}",
+                exc_info=True,
+            )
+            raise
+
+    def _prepare_selection(
+        self,
+        control_content: str = None,
+        control_name: str = None,
+        control_path: str = None,
+        documents: List[Dict[str, str]] = None,
+        omit_header: bool = False,
+    ) -> Tuple[str, List[Dict]]:
+        """
+        Validate the selection parameters and build the prompt for a single control.
+
+        Args:
+            control_content: The content of the ISO control file (optional if control_path provided)
+            control_name: The name of the ISO control
+            control_path: Path to the control file (optional if control_content provided)
+            documents: List of document dictionaries (see select_documents)
+            omit_header: Ask the agent to leave out the header, it is added by the caller
+
+        Returns:
+            Tuple of the control name and the prompt content blocks
+
+        Raises:
+            ValueError: If required parameters are missing
+        """
         # Read control file if path provided
         if control_path and not control_content:
             control_content = read_control_file(control_path)
@@ -230,126 +462,458 @@ class DocumentSelector:
 
         # If documents not provided, agent will use tools to read them
         if documents is None:
-            documents = read_all_documents(self.documents_dir)
+            documents = read_all_documents_preview(self.documents_dir)
 
         if not documents:
             raise ValueError(
                 f"Documents list cannot be empty. No documents found in {self.documents_dir}"
             )
 
-        # Prepare document summaries for the prompt
-        # Include title and first 500 characters of content for context
-        document_summaries = []
-        for i, doc in enumerate(documents, 1):
-            content_preview = doc["content"][:500] + (
-                "..." if len(doc["content"]) > 500 else ""
-            )
-            summary = f"""
-Document {i}:
-Title: {doc["title"]}
-Filename: {doc["filename"]}
-Confluence URL: {doc["url"]}
-Content Preview:
-{content_preview}
----
-"""
-            document_summaries.append(summary)
-
-        documents_text = "\n".join(document_summaries)
+        documents_text = self._build_documents_text(documents)
+        previews_text = self._build_previews_text(
+            documents, self._relevant_documents([control_content], documents)
+        )
 
-        prompt = f"""You are a helpful assistant specialized in ISO 27001 compliance and information security. Your task is to select the most relevant documents for an ISO 27001 control.
+        request_text = f"""Content previews of the documents most similar to the control:
+{previews_text}
 
-You have access to tools that can:
-- List all documents in the documents directory (_list_documents_tool)
-- Read full content of any document (_read_document_tool)
-- Read control files (_read_control_tool)
+ISO Control:
+{control_content}
 
-You are given:
-1. An ISO 27001 control description
-2. A list of available documents with their titles, URLs, and content previews
+Now select the 3-8 most relevant documents for the ISO control {control_name} and provide your output in the specified markdown format. Return only the markdown content, no additional text or explanations."""
+        if omit_header:
+            request_text += """ Leave out the "# Selected Documents" header line, start directly with the "## 1." heading of the first document."""
 
-If you need more detailed information about any document, you can use the _read_document_tool to read its full content.
+        prompt = self._build_prompt(documents_text, request_text)
 
-Your task:
-- Select 3-8 most important documents that are relevant to the ISO 27001 control
-- The number of documents should be based on how many documents are actually relevant (use fewer if there are fewer relevant documents)
-- Focus on documents that directly address the control requirements or support compliance with the control
-- Prioritize documents that are policies, procedures, or standards related to the control topic
-- Omit general documents that are not specifically relevant to this control
+        return control_name, prompt
 
-Output format:
-The output must be in markdown format exactly matching this structure:
+    def select_documents_batch(
+        self,
+        controls: List[Tuple[str, str]],
+        documents: List[Dict[str, str]] = None,
+    ) -> Dict[str, str]:
+        """
+        Select the most relevant documents for several ISO 27001 controls in a single agent call.
 
-{OUTPUT_FORMAT}
+        The controls are numbered in the prompt and the model is asked to wrap the
+        markdown for each of them in "=== BEGIN CONTROL i ===" / "=== END CONTROL i ==="
+        delimiters, so N controls cost one round-trip to Bedrock instead of N.
 
-Requirements:
-- Start with the header: "# Selected Documents for ISO 27001 Control [CONTROL_NAME]"
-- Make sure you have inclued [CONTROL_NAME] in the header of the file in OUTPUT_FORMAT.
-- For each selected document, include:
-  - A numbered heading: "## [NUMBER]. [DOCUMENT_TITLE]"
-  - The Confluence URL: "**Confluence URL:** [URL]"
-  - 2-3 lines explaining why this document was selected and how it relates to the ISO control
-- Use the exact document titles and URLs provided
-- Number the documents sequentially starting from 1
-- Select between 3-8 documents (use fewer if fewer are relevant)
-- Focus on relevance to ISO 27001 compliance and security
-
-ISO Control:
-{control_content}
+        Args:
+            controls: List of (control_name, control_content) tuples
+            documents: List of document dictionaries (see select_documents).
+                If not provided, documents are read from the documents directory.
 
-Available Documents:
-{documents_text}
+        Returns:
+            Dictionary mapping control_name to the markdown selection for that control.
+            Controls whose section is missing from the model response are omitted,
+            so callers can retry them with select_documents.
 
-Now select the 3-8 most relevant documents and provide your output in the specified markdown format. Return only the markdown content, no additional text or explanations."""
+        Raises:
+            ValueError: If required parameters are missing
+            Exception: If agent fails to generate selection
+        """
+        control_names, prompt = self._prepare_batch(controls, documents)
 
         try:
             logger.info(
-                f"Calling AI agent to select documents for control: {control_name}"
+                f"Calling AI agent to select documents for {len(controls)} controls: {control_names}"
             )
-            result_agent = self._agent(prompt)
-
-            # Extract text from AgentResult
-            pure_agent_response = str(result_agent).strip()
+            result_agent = self._invoke_agent(
+                prompt, self._batch_max_tokens(len(controls))
+            )
+            return self._parse_batch_response(str(result_agent), controls)
 
-            # Remove markdown code blocks if present (similar to DocumentKeywordsGenerator)
-            pure_agent_response = (
-                pure_agent_response.replace("```markdown", "")
-                .replace("```md", "")
-                .replace("```", "")
-                .strip()
+        except Exception as e:
+            logger.error(
+                f"Error selecting documents for controls {control_names}: {e}",
+                exc_info=True,
             )
+            raise
 
-            # Ensure the header includes the control name
-            if not pure_agent_response.startswith("# Selected Documents"):
-                # Try to fix if the format is slightly off
-                if "Selected Documents" in pure_agent_response:
-                    # Extract the relevant part
-                    start_idx = pure_agent_response.find("#")
-                    if start_idx >= 0:
-                        pure_agent_response = pure_agent_response[start_idx:].strip()
-                else:
-                    # If header is missing, add it
-                    pure_agent_response = (
-                        f"# Selected Documents for ISO 27001 Control {control_name}\n\n"
-                        + pure_agent_response
-                    )
+    async def select_documents_batch_async(
+        self,
+        controls: List[Tuple[str, str]],
+        documents: List[Dict[str, str]] = None,
+    ) -> Dict[str, str]:
+        """
+        Asynchronous version of select_documents_batch.
 
+        Args:
+            controls: List of (control_name, control_content) tuples
+            documents: List of document dictionaries (see select_documents)
+
+        Returns:
+            Dictionary mapping control_name to the markdown selection for that control
+            (controls missing from the model response are omitted)
+
+        Raises:
+            ValueError: If required parameters are missing
+            Exception: If agent fails to generate selection
+        """
+        control_names, prompt = self._prepare_batch(controls, documents)
+
+        try:
             logger.info(
-                f"Successfully generated document selection for control: {control_name}"
+                f"Calling AI agent to select documents for {len(controls)} controls: {control_names}"
             )
-            return pure_agent_response
+            result_agent = await self._invoke_agent_async(
+                prompt, self._batch_max_tokens(len(controls))
+            )
+            return self._parse_batch_response(str(result_agent), controls)
 
         except Exception as e:
             logger.error(
-                f"Error selecting documents for control {control_name}: {e}",
+                f"Error selecting documents for controls {control_names}: {e}",
                 exc_info=True,
             )
             raise
 
-    def print_agent_usage(self):
+    def _batch_max_tokens(self, controls_count: int) -> int:
+        """
+        Output token cap of a batched selection for the given number of controls.
+        """
+        return max(
+            self.max_output_tokens,
+            min(self.max_output_tokens * controls_count, BATCH_MAX_OUTPUT_TOKENS),
+        )
+
+    def _prepare_batch(
+        self,
+        controls: List[Tuple[str, str]],
+        documents: List[Dict[str, str]] = None,
+    ) -> Tuple[str, List[Dict]]:
+        """
+        Validate the batch parameters and build the prompt for several controls.
+
+        Args:
+            controls: List of (control_name, control_content) tuples
+            documents: List of document dictionaries (see select_documents)
+
+        Returns:
+            Tuple of the comma separated control names (for logging) and the prompt content blocks
+
+        Raises:
+            ValueError: If required parameters are missing
+        """
+        if not controls:
+            raise ValueError("controls list cannot be empty")
+
+        if documents is None:
+            documents = read_all_documents_preview(self.documents_dir)
+
+        if not documents:
+            raise ValueError(
+                f"Documents list cannot be empty. No documents found in {self.documents_dir}"
+            )
+
+        documents_text = self._build_documents_text(documents)
+        previews_text = self._build_previews_text(
+            documents,
+            self._relevant_documents(
+                [control_content for _, control_content in controls], documents
+            ),
+        )
+
+        controls_text = "\n".join(
+            f"### CONTROL {i}: {control_name}\n{control_content}\n"
+            for i, (control_name, control_content) in enumerate(controls, 1)
+        )
+        control_names = ", ".join(control_name for control_name, _ in controls)
+
+        prompt = self._build_prompt(
+            documents_text,
+            f"""Content previews of the documents most similar to the controls:
+{previews_text}
+
+ISO Controls:
+{controls_text}
+
+There are {len(controls)} ISO controls above, numbered "### CONTROL 1", "### CONTROL 2", ... Select documents for EACH control independently.
+
+Additional requirements:
+- Wrap the markdown of control number i between the lines "=== BEGIN CONTROL i ===" and "=== END CONTROL i ===", for example:
+=== BEGIN CONTROL 1 ===
+# Selected Documents for ISO 27001 Control [CONTROL_NAME]
+...
+=== END CONTROL 1 ===
+- Emit one section for every control, in the same order as the controls are given
+- Number the documents sequentially starting from 1 within each control
+
+Now select the 3-8 most relevant documents for each control and provide your output in the specified format. Return only the delimited markdown sections, no additional text or explanations.""",
+        )
+
+        return control_names, prompt
+
+    def _parse_batch_response(
+        self, response: str, controls: List[Tuple[str, str]]
+    ) -> Dict[str, str]:
+        """
+        Split a batched response into the markdown selections of the controls.
+
+        Args:
+            response: Text returned by the agent
+            controls: List of (control_name, control_content) tuples sent in the prompt
+
+        Returns:
+            Dictionary mapping control_name to the markdown selection for that control
+        """
+        sections = {
+            int(match.group(1)): match.group(2)
+            for match in BATCH_SECTION_RE.finditer(response)
+        }
+
+        results = {}
+        for i, (control_name, _) in enumerate(controls, 1):
+            if i not in sections:
+                logger.warning(
+                    f"Missing section for control {control_name} in batched response"
+                )
+                continue
+            results[control_name] = self._clean_agent_response(
+                sections[i], control_name
+            )
+
+        logger.info(
+            f"Successfully generated document selection for {len(results)} of {len(controls)} controls"
+        )
+        return results
+
+    @staticmethod
+    def _documents_key(documents: List[Dict[str, str]]) -> Tuple[Tuple[str, ...], ...]:
+        """
+        Key of a document list for the instance caches: filename, title, URL and
+        content (the preview when read with read_all_documents_preview) of every
+        document.
+        """
+        return tuple(
+            (doc["filename"], doc["title"], doc["url"], doc["content"])
+            for doc in documents
+        )
+
+    def _build_documents_text(self, documents: List[Dict[str, str]]) -> str:
+        """
+        Render the list of all documents included in the cached part of the prompt.
+
+        The rendered text of the latest documents is kept on the instance (see
+        _documents_key), so consecutive prompts share a byte-identical cached prefix.
+
+        Args:
+            documents: List of document dictionaries (see select_documents)
+
+        Returns:
+            One line with the number, title, filename and URL of every document
+        """
+        key = self._documents_key(documents)
+        cached = self._documents_text_cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        documents_text = "".join(
+            f"{i}. {doc['title']} [{doc['filename']}]({doc['url']})\n"
+            for i, doc in enumerate(documents, 1)
+        )
+        self._documents_text_cache = (key, documents_text)
+        return documents_text
+
+    def _relevant_documents(
+        self, control_contents: List[str], documents: List[Dict[str, str]]
+    ) -> List[int]:
+        """
+        Find the documents whose content preview is sent in the prompt.
+
+        Args:
+            control_contents: Contents of the ISO controls of the prompt
+            documents: List of document dictionaries (see select_documents)
+
+        Returns:
+            Sorted indices into documents of the RELEVANT_DOCUMENTS_COUNT documents
+            most similar to any of the controls
+        """
+        key = self._documents_key(documents)
+        cached = self._ranking_index_cache
+        if cached is not None and cached[0] == key:
+            index = cached[1]
+        else:
+            index = build_ranking_index(documents)
+            self._ranking_index_cache = (key, index)
+
+        relevant = set()
+        for control_content in control_contents:
+            relevant.update(rank_documents(control_content, documents, index=index))
+        return sorted(relevant)
+
+    @staticmethod
+    def _build_previews_text(
+        documents: List[Dict[str, str]], indices: List[int]
+    ) -> str:
+        """
+        Render the summaries of the selected documents.
+
+        Args:
+            documents: List of document dictionaries (see select_documents)
+            indices: Indices into documents of the documents to render
+
+        Returns:
+            Document summaries with title, filename, URL and the first 500
+            characters of content, numbered as in the list of all documents
+        """
+        parts = []
+        for i in indices:
+            doc = documents[i]
+            content_preview = doc.get("content_preview")
+            if content_preview is None:
+                content_preview = get_content_preview(doc["content"])
+            if parts:
+                parts.append("\n")
+            parts.append(
+                f"""
+Document {i + 1}:
+Title: {doc["title"]}
+Filename: {doc["filename"]}
+Confluence URL: {doc["url"]}
+Content Preview:
+{content_preview}
+---
+"""
+            )
+        return "".join(parts)
+
+    @staticmethod
+    def _build_prompt(documents_text: str, request_text: str) -> List[Dict]:
         """
-        Print the agent usage statistics.
+        Build the prompt content blocks: static documents first, then the control request.
 
-        Note: This method calls the agent with a dummy prompt to get usage stats.
+        Together with the cached system prompt the checkpoints go static -> static -> dynamic,
+        so only the control part is billed as fresh input tokens on repeated calls.
+
+        Args:
+            documents_text: Rendered document summaries
+            request_text: The control-specific part of the prompt
+
+        Returns:
+            List of content blocks for the agent
+        """
+        return [
+            {"text": f"Available Documents:\n{documents_text}"},
+            CACHE_POINT,
+            {"text": request_text},
+        ]
+
+    def _invoke_agent(self, prompt: List[Dict], max_tokens: int = None):
+        """
+        Call a fresh agent (see _create_agent) and record its token usage.
+
+        Args:
+            prompt: The prompt content blocks to send
+            max_tokens: Output token cap (default: max_output_tokens of the selector)
+
+        Returns:
+            AgentResult of the call
+        """
+        agent = self._create_agent(max_tokens)
+        try:
+            return invoke_agent(agent, prompt)
+        finally:
+            self._record_usage(agent)
+
+    async def _invoke_agent_async(self, prompt: List[Dict], max_tokens: int = None):
+        """
+        Asynchronous version of _invoke_agent.
+
+        Args:
+            prompt: The prompt content blocks to send
+            max_tokens: Output token cap (default: max_output_tokens of the selector)
+
+        Returns:
+            AgentResult of the call
+        """
+        agent = self._create_agent(max_tokens)
+        try:
+            return await invoke_agent_async(agent, prompt)
+        finally:
+            self._record_usage(agent)
+
+    def _record_usage(self, agent: Agent) -> None:
+        """
+        Add the token usage of an agent to the usage accumulated by the selector.
+
+        Args:
+            agent: Agent used for a single call
+        """
+        add_usage(self._usage, agent.event_loop_metrics.accumulated_usage)
+
+    @staticmethod
+    def _clean_agent_response(response: str, control_name: str) -> str:
+        """
+        Strip code fences from the agent response and make sure it starts with the header.
+
+        Args:
+            response: Raw text returned by the agent
+            control_name: The name of the ISO control
+
+        Returns:
+            The markdown selection for the control
+        """
+        pure_agent_response = response.strip()
+
+        # Remove markdown code blocks if present (similar to DocumentKeywordsGenerator)
+        pure_agent_response = (
+            pure_agent_response.replace("```markdown", "")
+            .replace("```md", "")
+            .replace("```", "")
+            .strip()
+        )
+
+        # Ensure the header includes the control name
+        if not pure_agent_response.startswith("# Selected Documents"):
+            # Try to fix if the format is slightly off
+            if "Selected Documents" in pure_agent_response:
+                # Extract the relevant part
+                start_idx = pure_agent_response.find("#")
+                if start_idx >= 0:
+                    pure_agent_response = pure_agent_response[start_idx:].strip()
+            else:
+                # If header is missing, add it
+                pure_agent_response = (
+                    f"# Selected Documents for ISO 27001 Control {control_name}\n\n"
+                    + pure_agent_response
+                )
+
+        return pure_agent_response
+
+    @staticmethod
+    async def _skip_header_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        Drop anything the agent generates before the first document heading.
+
+        The header is written by the caller, so a header or preamble the agent adds
+        anyway is dropped. Text is buffered only until the first "## " heading shows up;
+        if it never appears, the buffered response is yielded as is.
+
+        Args:
+            chunks: Text chunks of the response (without code fences)
+
+        Yields:
+            Text chunks of the markdown starting with the first document heading
+        """
+        lead = ""
+        async for chunk in chunks:
+            if lead is None:
+                yield chunk
+                continue
+            lead += chunk
+            start_idx = lead.find("## ")
+            if start_idx >= 0:
+                yield lead[start_idx:]
+                lead = None
+
+        if lead is not None:
+            yield lead
+
+    def print_agent_usage(self):
+        """
+        Print the agent usage statistics accumulated over all calls of the selector.
         """
-        print_agent_usage(self._agent)
+        print_agent_usage(self.model_id, self._usage)
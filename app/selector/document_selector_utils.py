@@ -2,14 +2,64 @@
 Utility functions for document selection operations.
 """
 
+import codecs
+import heapq
+import json
 import logging
+import math
+import mmap
 import os
 import re
-from typing import Dict, List
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of threads reading documents; reading is I/O-bound so it is above the CPU count.
+# Keep it low (e.g. READ_DOCUMENTS_WORKERS=4) when documents are on a rotating disk.
+READ_DOCUMENTS_WORKERS = int(
+    os.environ.get("READ_DOCUMENTS_WORKERS", min(32, (os.cpu_count() or 4) * 4))
+)
+
+# Metadata cache kept next to the documents directory (".documents_cache.json" for
+# "documents/"), so it is never listed as a document. Entries are keyed by filename
+# and are valid while the file modification time and size are unchanged
+DOCUMENTS_CACHE_FILENAME = ".{}_cache.json"
+
+# First markdown heading of a document (the title), searched in TITLE_SEARCH_LENGTH characters
+TITLE_RE = re.compile(r"^[ \t]*#[ \t]*(.*?)[ \t]*\r?$", re.MULTILINE)
+TITLE_SEARCH_LENGTH = 4096
+# "**Source URL:**" line of a document, near the top of the document as well
+URL_RE = re.compile(r"\*\*Source URL:\*\*\s*(https?://\S+)")
+URL_SEARCH_LENGTH = 8192
+# Byte versions of the patterns, for searching memory-mapped documents
+TITLE_BYTES_RE = re.compile(TITLE_RE.pattern.encode(), re.MULTILINE)
+URL_BYTES_RE = re.compile(URL_RE.pattern.encode())
+
+# Number of characters of document content included in the prompt
+CONTENT_PREVIEW_LENGTH = 500
+# Number of characters read by read_all_documents_preview, enough for the title,
+# the source URL and the content preview
+DOCUMENT_PREVIEW_READ_CHARS = 2048
+
+# Number of documents most similar to a control whose content preview is sent in the prompt,
+# the other documents are only listed by title. Higher values trade input tokens for recall.
+RELEVANT_DOCUMENTS_COUNT = int(os.environ.get("RELEVANT_DOCUMENTS_COUNT", 20))
+# Words used for ranking documents against a control
+TOKEN_RE = re.compile(r"[a-z0-9]{2,}")
+# Start of the guidance section of a control file, the guidance covers many loosely
+# related topics so only the text before it (control statement and purpose) is ranked
+CONTROL_GUIDANCE_RE = re.compile(r"^#+\s*Guidance\b", re.MULTILINE)
+
+# Write buffer size of save_selected_documents_streaming
+OUTPUT_WRITE_BUFFER_SIZE = 64 * 1024
+
+# Markdown code fences the agent may wrap its response in
+MARKDOWN_FENCE_RE = re.compile(r"```(?:markdown|md)?")
+# Longest fence ("```markdown"), text this close to the end of a chunk may be a split fence
+MARKDOWN_FENCE_MAX_LENGTH = len("```markdown")
+
 
 def read_control_file(control_path: str) -> str:
     """
@@ -30,7 +80,7 @@ def read_control_file(control_path: str) -> str:
             raise FileNotFoundError(f"Control file not found: {control_path}")
         with open(control_path, "r", encoding="utf-8") as file:
             content = file.read()
-        logger.info(f"Successfully read control file: {control_path}")
+        logger.debug("Successfully read control file: %s", control_path)
         return content
     except Exception as e:
         logger.error(f"Error reading control file {control_path}: {e}", exc_info=True)
@@ -52,19 +102,12 @@ def extract_document_metadata(document_content: str, filename: str) -> Dict[str,
     url = ""
 
     # Extract title from first line starting with #
-    lines = document_content.split("\n")
-    for line in lines:
-        line_stripped = line.strip()
-        if line_stripped.startswith("# "):
-            title = line_stripped[2:].strip()  # Remove "# " prefix
-            break
-        elif line_stripped.startswith("#"):
-            title = line_stripped[1:].strip()  # Remove "#" prefix
-            break
+    title_match = TITLE_RE.search(document_content, 0, TITLE_SEARCH_LENGTH)
+    if title_match:
+        title = title_match.group(1)
 
     # Extract URL from **Source URL:** line
-    url_pattern = r"\*\*Source URL:\*\*\s*(https?://[^\s]+)"
-    url_match = re.search(url_pattern, document_content)
+    url_match = URL_RE.search(document_content, 0, URL_SEARCH_LENGTH)
     if url_match:
         url = url_match.group(1).strip()
 
@@ -80,23 +123,377 @@ def extract_document_metadata(document_content: str, filename: str) -> Dict[str,
     }
 
 
-def read_all_documents(documents_dir: str) -> List[Dict[str, str]]:
+def extract_document_metadata_mmap(
+    file_path: str, filename: str, size: int, preview_chars: int
+) -> Dict[str, str]:
     """
-    Read all documents from the documents directory and extract metadata.
+    Extract metadata (title and URL) and the content preview of a document file.
+
+    The file is memory-mapped and searched as bytes, only the matched title and URL
+    and the beginning of the document are decoded.
 
     Args:
-        documents_dir: Path to the documents directory
+        file_path: Path to the document file
+        filename: The filename of the document
+        size: Size of the file in bytes
+        preview_chars: Number of characters of content to decode
 
     Returns:
-        List of dictionaries, each containing document metadata:
-        - filename: Document filename
-        - content: Full document content
-        - title: Document title
-        - url: Confluence URL
+        Dictionary with keys: filename, content (the content preview), title, url,
+        content_preview
 
     Raises:
-        FileNotFoundError: If the documents directory doesn't exist
-        IOError: If there's an error reading files
+        UnicodeDecodeError: If the beginning of the document is not valid UTF-8
+    """
+    title = ""
+    url = ""
+    head = b""
+
+    if size:
+        with open(file_path, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            title_match = TITLE_BYTES_RE.search(mapped, 0, TITLE_SEARCH_LENGTH)
+            if title_match:
+                title = title_match.group(1).decode("utf-8", errors="replace")
+
+            url_match = URL_BYTES_RE.search(mapped, 0, URL_SEARCH_LENGTH)
+            if url_match:
+                url = url_match.group(1).decode("utf-8", errors="replace").strip()
+
+            # A UTF-8 character takes at most 4 bytes
+            head = mapped[: preview_chars * 4]
+
+    # The incremental decoder keeps a character cut at the end of head out of the result
+    content = codecs.getincrementaldecoder("utf-8")().decode(
+        head, final=len(head) == size
+    )
+    content = content.replace("\r\n", "\n").replace("\r", "\n")[:preview_chars]
+
+    # If title is still empty, use filename without extension as fallback
+    if not title:
+        title = os.path.splitext(filename)[0]
+
+    content_preview = get_content_preview(content)
+    return {
+        "filename": filename,
+        "content": content_preview,
+        "title": title,
+        "url": url,
+        "content_preview": content_preview,
+    }
+
+
+def get_content_preview(content: str) -> str:
+    """
+    Get the beginning of the document content used in the prompt.
+
+    Args:
+        content: The full content of the document
+
+    Returns:
+        The first CONTENT_PREVIEW_LENGTH characters, with "..." if the content is longer
+    """
+    return content[:CONTENT_PREVIEW_LENGTH] + (
+        "..." if len(content) > CONTENT_PREVIEW_LENGTH else ""
+    )
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase words for ranking.
+
+    Args:
+        text: The text to split
+
+    Returns:
+        List of lowercase alphanumeric words of at least 2 characters
+    """
+    return TOKEN_RE.findall(text.lower())
+
+
+def _tfidf_vector(counts: Counter, idf: Dict[str, float]) -> Dict[str, float]:
+    """
+    Build the L2-normalized TF-IDF vector of a bag of words; unknown words are ignored.
+    """
+    weights = {
+        term: (1 + math.log(count)) * idf[term]
+        for term, count in counts.items()
+        if term in idf
+    }
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    if not norm:
+        return {}
+    return {term: weight / norm for term, weight in weights.items()}
+
+
+def build_ranking_index(documents: List[Dict[str, str]]) -> Dict:
+    """
+    Build the TF-IDF index used by rank_documents.
+
+    Args:
+        documents: List of document dictionaries with title, filename and content
+
+    Returns:
+        Dictionary with the inverse document frequency of every word ("idf") and the
+        TF-IDF vector of every document ("vectors"), in the order of the documents
+    """
+    documents_tokens = [
+        tokenize(f"{doc['title']} {doc['filename']} {doc['content']}")
+        for doc in documents
+    ]
+
+    document_frequency = Counter()
+    for tokens in documents_tokens:
+        document_frequency.update(set(tokens))
+
+    # Smoothed IDF, words present in every document still get a small positive weight
+    count = len(documents)
+    idf = {
+        term: math.log((1 + count) / (1 + frequency)) + 1
+        for term, frequency in document_frequency.items()
+    }
+
+    return {
+        "idf": idf,
+        "vectors": [_tfidf_vector(Counter(tokens), idf) for tokens in documents_tokens],
+    }
+
+
+def rank_documents(
+    control_content: str,
+    documents: List[Dict[str, str]],
+    k: int = RELEVANT_DOCUMENTS_COUNT,
+    index: Optional[Dict] = None,
+) -> List[int]:
+    """
+    Rank documents by the TF-IDF cosine similarity of their content to a control.
+
+    Only the part of the control before its guidance section is used as the query.
+
+    Args:
+        control_content: The content of the ISO control file
+        documents: List of document dictionaries with title, filename and content
+        k: Number of documents to return
+        index: Index built by build_ranking_index for these documents (built if not provided)
+
+    Returns:
+        Indices into documents of the k most similar documents, most similar first
+    """
+    if index is None:
+        index = build_ranking_index(documents)
+
+    guidance_match = CONTROL_GUIDANCE_RE.search(control_content)
+    if guidance_match:
+        control_content = control_content[: guidance_match.start()]
+
+    query = _tfidf_vector(Counter(tokenize(control_content)), index["idf"])
+    scores = [
+        sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+        for vector in index["vectors"]
+    ]
+    return heapq.nlargest(k, range(len(scores)), key=scores.__getitem__)
+
+
+def get_documents_cache_path(documents_dir: str) -> str:
+    """
+    Get the path of the document metadata cache for a documents directory.
+
+    Args:
+        documents_dir: Path to the documents directory
+
+    Returns:
+        Path to the cache file, in the parent directory of documents_dir
+    """
+    documents_dir = os.path.abspath(documents_dir)
+    return os.path.join(
+        os.path.dirname(documents_dir),
+        DOCUMENTS_CACHE_FILENAME.format(os.path.basename(documents_dir)),
+    )
+
+
+def load_documents_cache(documents_dir: str) -> Dict[str, Dict]:
+    """
+    Load the document metadata cache.
+
+    Args:
+        documents_dir: Path to the documents directory
+
+    Returns:
+        Dictionary mapping filename to the cached entry (mtime_ns, size, title, url,
+        content_preview). Empty if there is no usable cache.
+    """
+    cache_path = get_documents_cache_path(documents_dir)
+    try:
+        with open(cache_path, "r", encoding="utf-8") as file:
+            return json.load(file).get("files", {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable documents cache {cache_path}: {e}")
+        return {}
+
+
+def save_documents_cache(documents_dir: str, entries: Dict[str, Dict]) -> None:
+    """
+    Save the document metadata cache atomically.
+
+    A failure to write the cache is logged and otherwise ignored.
+
+    Args:
+        documents_dir: Path to the documents directory
+        entries: Dictionary mapping filename to the cache entry
+    """
+    cache_path = get_documents_cache_path(documents_dir)
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"documents_dir": os.path.abspath(documents_dir), "files": entries},
+                file,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"Could not save documents cache {cache_path}: {e}")
+
+
+def load_cached_documents_preview(documents_dir: str) -> Optional[List[Dict[str, str]]]:
+    """
+    Load the document previews from the metadata cache without checking the files.
+
+    Args:
+        documents_dir: Path to the documents directory
+
+    Returns:
+        List of dictionaries as returned by read_all_documents_preview, or None if there
+        is no usable cache or it was written for another documents directory
+    """
+    cache_path = get_documents_cache_path(documents_dir)
+    try:
+        with open(cache_path, "r", encoding="utf-8") as file:
+            cache = json.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable documents cache {cache_path}: {e}")
+        return None
+
+    if cache.get("documents_dir") != os.path.abspath(documents_dir):
+        logger.warning(
+            f"Documents cache {cache_path} was written for "
+            f"{cache.get('documents_dir')}, reading the documents"
+        )
+        return None
+
+    files = cache.get("files")
+    if not files:
+        return None
+
+    logger.info(f"Using {len(files)} documents from the trusted cache {cache_path}")
+    return [_cached_metadata(filename, cached) for filename, cached in files.items()]
+
+
+def _cached_metadata(filename: str, cached: Dict) -> Dict[str, str]:
+    """
+    Build the preview metadata of a document from its cache entry.
+    """
+    return {
+        "filename": filename,
+        "content": cached["content_preview"],
+        "title": cached["title"],
+        "url": cached["url"],
+        "content_preview": cached["content_preview"],
+    }
+
+
+def _cache_entry(stat: os.stat_result, metadata: Dict[str, str]) -> Dict:
+    """
+    Build the documents cache entry of a document from its stat result and metadata.
+    """
+    return {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "title": metadata["title"],
+        "url": metadata["url"],
+        "content_preview": metadata["content_preview"],
+    }
+
+
+def _read_document(
+    entry: os.DirEntry,
+    cached: Optional[Dict],
+    preview_chars: Optional[int] = None,
+) -> Optional[Tuple[Dict[str, str], Dict]]:
+    """
+    Read a single document and extract its metadata, using the cache if it is up to date.
+
+    Args:
+        entry: The directory entry of the document
+        cached: The cache entry of the document, if any
+        preview_chars: If set, the document is memory-mapped and only its first
+            preview_chars characters are decoded (see extract_document_metadata_mmap);
+            the content preview is returned as content. An up-to-date cache entry
+            then avoids opening the file at all.
+
+    Returns:
+        Tuple of the document metadata (with content_preview) and its cache entry,
+        or None if the document could not be read
+    """
+    filename = entry.name
+    file_path = entry.path
+    try:
+        stat = entry.stat()
+        up_to_date = (
+            cached is not None
+            and cached["mtime_ns"] == stat.st_mtime_ns
+            and cached["size"] == stat.st_size
+        )
+
+        if up_to_date and preview_chars is not None:
+            return _cached_metadata(filename, cached), cached
+
+        if preview_chars is not None:
+            metadata = extract_document_metadata_mmap(
+                file_path, filename, stat.st_size, preview_chars
+            )
+            return metadata, _cache_entry(stat, metadata)
+
+        with open(file_path, "r", encoding="utf-8") as file:
+            content = file.read()
+
+        if up_to_date:
+            metadata = {
+                "filename": filename,
+                "content": content,
+                "title": cached["title"],
+                "url": cached["url"],
+                "content_preview": cached["content_preview"],
+            }
+            return metadata, cached
+
+        metadata = extract_document_metadata(content, filename)
+        metadata["content_preview"] = get_content_preview(content)
+        return metadata, _cache_entry(stat, metadata)
+    except Exception as e:
+        logger.warning(
+            "Error reading document %s: %s. Skipping.", filename, e, exc_info=True
+        )
+        return None
+
+
+def _read_documents(
+    documents_dir: str, preview_chars: Optional[int] = None
+) -> List[Dict[str, str]]:
+    """
+    Read all documents from the documents directory, see read_all_documents.
+
+    Args:
+        documents_dir: Path to the documents directory
+        preview_chars: If set, only the beginning of every document is read (see _read_document)
+
+    Returns:
+        List of dictionaries with document metadata
     """
     documents = []
 
@@ -108,11 +505,8 @@ def read_all_documents(documents_dir: str) -> List[Dict[str, str]]:
             raise ValueError(f"Path is not a directory: {documents_dir}")
 
         # Get all .md files in the directory
-        files = [
-            f
-            for f in os.listdir(documents_dir)
-            if f.endswith(".md") and os.path.isfile(os.path.join(documents_dir, f))
-        ]
+        with os.scandir(documents_dir) as entries:
+            files = [e for e in entries if e.name.endswith(".md") and e.is_file()]
 
         if not files:
             logger.warning(f"No markdown files found in {documents_dir}")
@@ -120,19 +514,23 @@ def read_all_documents(documents_dir: str) -> List[Dict[str, str]]:
 
         logger.info(f"Found {len(files)} documents to process")
 
-        for filename in files:
-            file_path = os.path.join(documents_dir, filename)
-            try:
-                with open(file_path, "r", encoding="utf-8") as file:
-                    content = file.read()
-                metadata = extract_document_metadata(content, filename)
-                documents.append(metadata)
-            except Exception as e:
-                logger.warning(
-                    f"Error reading document {filename}: {e}. Skipping.",
-                    exc_info=True,
-                )
-                continue
+        cache = load_documents_cache(documents_dir)
+
+        # Read documents concurrently, the order of the files is preserved
+        with ThreadPoolExecutor(max_workers=READ_DOCUMENTS_WORKERS) as executor:
+            results = executor.map(
+                lambda entry: _read_document(
+                    entry, cache.get(entry.name), preview_chars
+                ),
+                files,
+            )
+            results = [result for result in results if result is not None]
+
+        documents.extend(metadata for metadata, _ in results)
+
+        entries = {metadata["filename"]: entry for metadata, entry in results}
+        if entries != cache:
+            save_documents_cache(documents_dir, entries)
 
         logger.info(f"Successfully processed {len(documents)} documents")
         return documents
@@ -144,6 +542,67 @@ def read_all_documents(documents_dir: str) -> List[Dict[str, str]]:
         raise
 
 
+def read_all_documents(documents_dir: str) -> List[Dict[str, str]]:
+    """
+    Read all documents from the documents directory and extract metadata.
+
+    Extracted metadata is cached in DOCUMENTS_CACHE_FILENAME, so unchanged documents
+    are not parsed again on the next run.
+
+    Args:
+        documents_dir: Path to the documents directory
+
+    Returns:
+        List of dictionaries, each containing document metadata:
+        - filename: Document filename
+        - content: Full document content
+        - title: Document title
+        - url: Confluence URL
+        - content_preview: Beginning of the content used in the prompt
+
+    Raises:
+        FileNotFoundError: If the documents directory doesn't exist
+        IOError: If there's an error reading files
+    """
+    return _read_documents(documents_dir)
+
+
+def read_all_documents_preview(
+    documents_dir: str,
+    preview_chars: int = DOCUMENT_PREVIEW_READ_CHARS,
+    trust_cache: bool = False,
+) -> List[Dict[str, str]]:
+    """
+    Read the beginning of all documents from the documents directory and extract metadata.
+
+    Only the first preview_chars characters of a document are read (none at all
+    if its cache entry is up to date), which is all the prompt needs. The full
+    content can still be read on demand by the agent tools.
+
+    Args:
+        documents_dir: Path to the documents directory
+        preview_chars: Number of characters read from documents missing from the cache
+        trust_cache: Return the cached documents as they are, without listing the
+            directory or checking the files (for a corpus that does not change, e.g.
+            baked into an image). Falls back to reading the documents without a
+            usable cache for this directory.
+
+    Returns:
+        List of dictionaries with the same keys as read_all_documents, where
+        content holds the content preview instead of the full content
+
+    Raises:
+        FileNotFoundError: If the documents directory doesn't exist
+        IOError: If there's an error reading files
+    """
+    if trust_cache:
+        documents = load_cached_documents_preview(documents_dir)
+        if documents is not None:
+            return documents
+
+    return _read_documents(documents_dir, preview_chars)
+
+
 def save_selected_documents(output_path: str, content: str) -> None:
     """
     Save the selected documents markdown output to a file.
@@ -164,7 +623,52 @@ def save_selected_documents(output_path: str, content: str) -> None:
 
         with open(output_path, "w", encoding="utf-8") as file:
             file.write(content)
-        logger.info(f"Successfully saved selected documents to: {output_path}")
+        logger.debug("Successfully saved selected documents to: %s", output_path)
+    except Exception as e:
+        logger.error(
+            f"Error saving selected documents to {output_path}: {e}", exc_info=True
+        )
+        raise
+
+
+async def save_selected_documents_streaming(
+    output_path: str, chunks: AsyncIterator[str]
+) -> None:
+    """
+    Save the selected documents markdown output to a file while it is generated.
+
+    Every chunk is written as it arrives, so the complete response is never held
+    in memory. The chunks go to a temporary file that replaces output_path only once
+    the stream is complete, so a failed selection keeps the previous file.
+
+    Args:
+        output_path: Path where the output file should be saved
+        chunks: Text chunks of the markdown content
+
+    Raises:
+        IOError: If there's an error writing the file
+        Exception: Any error raised while producing the chunks
+    """
+    try:
+        # Create directory if it doesn't exist
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+            logger.info(f"Created output directory: {output_dir}")
+
+        tmp_path = f"{output_path}.tmp"
+        try:
+            with open(
+                tmp_path, "w", encoding="utf-8", buffering=OUTPUT_WRITE_BUFFER_SIZE
+            ) as file:
+                async for chunk in chunks:
+                    file.write(chunk)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logger.debug("Successfully saved selected documents to: %s", output_path)
     except Exception as e:
         logger.error(
             f"Error saving selected documents to {output_path}: {e}", exc_info=True
@@ -186,3 +690,49 @@ def get_control_name_from_path(control_path: str) -> str:
     # Remove .md extension
     control_name = os.path.splitext(filename)[0]
     return control_name
+
+
+async def strip_markdown_fences_stream(
+    chunks: AsyncIterator[str],
+) -> AsyncIterator[str]:
+    """
+    Remove markdown code fences from a streamed response.
+
+    A fence may be split across chunks, so the last few characters of every chunk
+    are held back until the next chunk shows whether they start a fence.
+
+    Args:
+        chunks: Text chunks of the response
+
+    Yields:
+        Text chunks without code fences (the end of the response is right-stripped)
+    """
+    pending = ""
+    # Whitespace is only emitted once it is followed by text, so the response is stripped
+    whitespace = ""
+    started = False
+    async for chunk in chunks:
+        pending += chunk
+        cut = len(pending) - MARKDOWN_FENCE_MAX_LENGTH
+        if cut <= 0:
+            continue
+        # Hold back any backtick run that may belong to a fence crossing the cut
+        window_start = max(cut - MARKDOWN_FENCE_MAX_LENGTH + 1, 0)
+        backtick = pending.find("`", window_start, cut)
+        if backtick >= 0:
+            cut = backtick
+            while cut > 0 and pending[cut - 1] == "`":
+                cut -= 1
+        if cut > 0:
+            text = MARKDOWN_FENCE_RE.sub("", pending[:cut])
+            pending = pending[cut:]
+            body = text.rstrip()
+            if body:
+                yield whitespace + body if started else body.lstrip()
+                started = True
+                whitespace = text[len(body) :]
+            else:
+                whitespace += text
+    body = MARKDOWN_FENCE_RE.sub("", pending).rstrip()
+    if body:
+        yield whitespace + body if started else body.lstrip()
@@ -2,27 +2,46 @@
 Simple execution script for ISO 27001 controls.
 
 This script demonstrates how to use DocumentSelector to select relevant documents
-for a specific ISO control by control ID (e.g., 5.1, 8.3, 8.15).
+for ISO controls by control ID (e.g., 5.1, 8.3, 8.15).
 
 Usage:
     python execute_control.py 5.7
     python execute_control.py 8.15
     python execute_control.py 5.1
+    python execute_control.py 5.1 5.2 5.3 5.4 --batch-size 4
+    python execute_control.py 5.1 5.2 5.3 5.4 --batch-size 1 --concurrency 4
+    echo "5.1 5.2" | python execute_control.py --daemon
 """
 
 import argparse
+import asyncio
 import logging
 import os
-import glob
-from app.selector.DocumentSelector_class import DocumentSelector
+import sys
+from typing import Dict, List
+from app.selector.DocumentSelector_class import (
+    BATCH_MAX_OUTPUT_TOKENS,
+    DocumentSelector,
+)
+from app.utils.ai_agent import SELECTION_MODEL
+from strands.types.exceptions import MaxTokensReachedException
 from app.selector.document_selector_utils import (
     get_control_name_from_path,
+    read_all_documents_preview,
+    read_control_file,
     save_selected_documents,
+    save_selected_documents_streaming,
 )
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of controls sent to the agent in a single call
+DEFAULT_BATCH_SIZE = 4
+# Upper bound keeping the batched prompt and response within the model context
+MAX_BATCH_SIZE = 8
+# Number of agent calls running at the same time (keeps within Bedrock rate limits)
+DEFAULT_CONCURRENCY = 4
+
 
 def find_control_file(control_id: str, controls_dir: str = "controls") -> str:
     """
@@ -39,18 +58,22 @@ def find_control_file(control_id: str, controls_dir: str = "controls") -> str:
         FileNotFoundError: If no matching control file is found
         ValueError: If multiple matching files are found
     """
-    # Get all markdown files in the controls directory
-    pattern = os.path.join(controls_dir, "*.md")
-    all_files = glob.glob(pattern)
-
-    # Filter files that start with the exact control ID followed by a space or .md
-    # This ensures "5.2" matches "5.2 Information..." but not "5.20 Addressing..."
+    # Find markdown files that start with the exact control ID followed by a space
+    # or .md. This ensures "5.2" matches "5.2 Information..." but not "5.20 Addressing..."
+    # The scan stops at the second match, which is enough to report ambiguous IDs
+    prefix = f"{control_id} "
+    exact_name = f"{control_id}.md"
     matching_files = []
-    for file_path in all_files:
-        filename = os.path.basename(file_path)
-        # Check if filename starts with control_id followed by space or .md extension
-        if filename.startswith(f"{control_id} ") or filename == f"{control_id}.md":
-            matching_files.append(file_path)
+    if os.path.isdir(controls_dir):
+        with os.scandir(controls_dir) as entries:
+            for entry in entries:
+                filename = entry.name
+                if filename.endswith(".md") and (
+                    filename.startswith(prefix) or filename == exact_name
+                ):
+                    matching_files.append(entry.path)
+                    if len(matching_files) > 1:
+                        break
 
     if not matching_files:
         raise FileNotFoundError(
@@ -63,27 +86,211 @@ def find_control_file(control_id: str, controls_dir: str = "controls") -> str:
         )
 
     control_path = matching_files[0]
-    logger.info(f"Found control file: {control_path}")
+    logger.info("Found control file: %s", control_path)
     return control_path
 
 
+async def process_batch(
+    selector: DocumentSelector,
+    batch_paths: List[str],
+    output_dir: str,
+    semaphore: asyncio.Semaphore,
+    documents: List[Dict[str, str]] = None,
+) -> None:
+    """
+    Select documents for a batch of controls and save the results.
+
+    A single control is streamed straight into its output file, several controls
+    are selected with one batched agent call. Calls reaching the output token cap
+    are retried for each control on its own (a single control with a higher cap).
+
+    Args:
+        selector: The DocumentSelector to use
+        batch_paths: Paths to the control files of the batch
+        output_dir: Output directory for selected documents
+        semaphore: Semaphore limiting the number of concurrent agent calls
+        documents: Documents to select from (read by the selector if not provided)
+    """
+    control_names = [get_control_name_from_path(p) for p in batch_paths]
+
+    if len(batch_paths) == 1:
+        control_name, control_path = control_names[0], batch_paths[0]
+        logger.info("Control file: %s", control_path)
+        output_path = os.path.join(output_dir, f"{control_name}.md")
+        async with semaphore:
+            try:
+                await save_selected_documents_streaming(
+                    output_path,
+                    selector.select_documents_stream(
+                        control_path=control_path,
+                        control_name=control_name,
+                        documents=documents,
+                    ),
+                )
+            except MaxTokensReachedException:
+                logger.warning(
+                    "Selection for %s exceeded the output token cap, "
+                    "retrying with a cap of %d tokens",
+                    control_name,
+                    BATCH_MAX_OUTPUT_TOKENS,
+                )
+                result = await selector.select_documents_async(
+                    control_path=control_path,
+                    control_name=control_name,
+                    documents=documents,
+                    max_tokens=BATCH_MAX_OUTPUT_TOKENS,
+                )
+                await asyncio.to_thread(save_selected_documents, output_path, result)
+        logger.info("Successfully completed document selection for %s", control_name)
+        logger.info("Output saved to: %s", output_path)
+        return
+
+    controls = [
+        (control_name, read_control_file(control_path))
+        for control_name, control_path in zip(control_names, batch_paths)
+    ]
+    async with semaphore:
+        try:
+            results = await selector.select_documents_batch_async(controls, documents)
+        except MaxTokensReachedException:
+            logger.warning(
+                f"Batched selection exceeded the output token cap, "
+                f"processing controls one by one: {', '.join(control_names)}"
+            )
+            results = {}
+
+        # Controls missing from the batched response are processed on their own
+        for control_name, control_path in zip(control_names, batch_paths):
+            if control_name not in results:
+                logger.info("Control file: %s", control_path)
+                results[control_name] = await selector.select_documents_async(
+                    control_path=control_path,
+                    control_name=control_name,
+                    documents=documents,
+                )
+
+    # Save the results
+    for control_name in control_names:
+        output_filename = f"{control_name}.md"
+        output_path = os.path.join(output_dir, output_filename)
+        await asyncio.to_thread(
+            save_selected_documents, output_path, results[control_name]
+        )
+
+        logger.info("Successfully completed document selection for %s", control_name)
+        logger.info("Output saved to: %s", output_path)
+
+
+async def process_controls(
+    selector: DocumentSelector,
+    control_paths: List[str],
+    output_dir: str,
+    batch_size: int,
+    concurrency: int,
+    documents: List[Dict[str, str]] = None,
+) -> int:
+    """
+    Select documents for all controls, running the batches concurrently.
+
+    Args:
+        selector: The DocumentSelector to use
+        control_paths: Paths to the control files
+        output_dir: Output directory for selected documents
+        batch_size: Number of controls processed in a single agent call
+        concurrency: Maximum number of agent calls running at the same time
+        documents: Documents to select from (read by the selector if not provided)
+
+    Returns:
+        Number of batches that failed
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = [
+        control_paths[start : start + batch_size]
+        for start in range(0, len(control_paths), batch_size)
+    ]
+    results = await asyncio.gather(
+        *(
+            process_batch(selector, batch_paths, output_dir, semaphore, documents)
+            for batch_paths in batches
+        ),
+        return_exceptions=True,
+    )
+
+    failed = 0
+    for batch_paths, result in zip(batches, results):
+        if isinstance(result, Exception):
+            logger.error(
+                f"Error during document selection for {batch_paths}: {result}",
+                exc_info=result,
+            )
+            failed += 1
+    return failed
+
+
+def run_controls(selector: DocumentSelector, control_ids: List[str], args) -> int:
+    """
+    Select documents for the given control IDs with an already initialized selector.
+
+    Args:
+        selector: The DocumentSelector to use
+        control_ids: ISO 27001 control IDs
+        args: Parsed command-line arguments
+
+    Returns:
+        Exit code, 0 if documents were selected for all controls
+    """
+    # Find the control files before any agent call
+    control_paths = []
+    for control_id in control_ids:
+        try:
+            control_paths.append(find_control_file(control_id, args.controls_dir))
+        except (FileNotFoundError, ValueError) as e:
+            logger.error(str(e))
+            return 1
+
+    # Read the documents once for all controls (from the metadata cache when up to date)
+    documents = read_all_documents_preview(
+        args.documents_dir, trust_cache=args.trust_cache
+    )
+    if not documents:
+        logger.error(f"No documents found in {args.documents_dir}")
+        return 1
+
+    # Select documents in batches of controls, batches run concurrently
+    logger.info(f"Selecting relevant documents for controls: {control_ids}")
+    failed = asyncio.run(
+        process_controls(
+            selector,
+            control_paths,
+            args.output_dir,
+            min(args.batch_size, MAX_BATCH_SIZE),
+            args.concurrency,
+            documents,
+        )
+    )
+    return 1 if failed else 0
+
+
 def main():
-    """Execute document selection for a specified ISO control."""
+    """Execute document selection for the specified ISO controls."""
     # Parse command-line arguments
     parser = argparse.ArgumentParser(
-        description="Select relevant documents for an ISO 27001 control",
+        description="Select relevant documents for ISO 27001 controls",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
   python execute_control.py 5.7
   python execute_control.py 8.15
   python execute_control.py 5.1
+  python execute_control.py 5.1 5.2 5.3 5.4 --batch-size 4
+  echo "5.1 5.2" | python execute_control.py --daemon
         """,
     )
     parser.add_argument(
-        "control_id",
+        "control_ids",
         type=str,
-        help="ISO 27001 control ID (e.g., 5.1, 8.3, 8.15)",
+        nargs="*",
+        help="ISO 27001 control IDs (e.g., 5.1, 8.3, 8.15)",
     )
     parser.add_argument(
         "--controls-dir",
@@ -103,41 +310,64 @@ Examples:
         default="selected_documents_agent",
         help="Output directory for selected documents (default: selected_documents_agent)",
     )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=SELECTION_MODEL,
+        help=f"Bedrock model ID used for the selection (default: {SELECTION_MODEL})",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Number of controls processed in a single agent call "
+        f"(default: {DEFAULT_BATCH_SIZE}, max: {MAX_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Number of agent calls running at the same time (default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--trust-cache",
+        action="store_true",
+        help="Use the documents metadata cache as it is, without checking the documents "
+        "for changes (for a documents directory that does not change)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and read control IDs from stdin (one or more per line) until EOF",
+    )
 
     args = parser.parse_args()
 
-    # Find the control file
-    try:
-        control_path = find_control_file(args.control_id, args.controls_dir)
-    except (FileNotFoundError, ValueError) as e:
-        logger.error(str(e))
-        return 1
+    logging.basicConfig(level=logging.INFO)
 
-    # Get control name from path
-    control_name = get_control_name_from_path(control_path)
+    if not args.control_ids and not args.daemon:
+        parser.error("at least one control ID is required (or use --daemon)")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
 
-    # Initialize DocumentSelector
-    logger.info(f"Initializing DocumentSelector for control: {control_name}")
-    logger.info(f"Control ID: {args.control_id}")
-    logger.info(f"Control file: {control_path}")
-    selector = DocumentSelector(documents_dir=args.documents_dir)
-
-    # Select documents using the control path
-    # The agent will read the control file and documents automatically
-    logger.info("Selecting relevant documents...")
+    # Initialize DocumentSelector and its agent once for all controls
+    logger.info("Initializing DocumentSelector...")
+    selector = DocumentSelector(documents_dir=args.documents_dir, model_id=args.model)
+    exit_code = 0
     try:
-        result = selector.select_documents(
-            control_path=control_path,
-            control_name=control_name,
-        )
+        selector.initialize_agent()
 
-        # Save the result
-        output_filename = f"{control_name}.md"
-        output_path = os.path.join(args.output_dir, output_filename)
-        save_selected_documents(output_path, result)
+        if args.control_ids:
+            exit_code = run_controls(selector, args.control_ids, args)
 
-        logger.info(f"Successfully completed document selection for {control_name}")
-        logger.info(f"Output saved to: {output_path}")
+        if args.daemon:
+            logger.info("Reading control IDs from stdin...")
+            for line in sys.stdin:
+                control_ids = line.split()
+                if control_ids:
+                    exit_code = run_controls(selector, control_ids, args) or exit_code
 
         # Print agent usage statistics
         logger.info("\n" + "=" * 50)
@@ -149,7 +379,7 @@ Examples:
         logger.error(f"Error during document selection: {e}", exc_info=True)
         return 1
 
-    return 0
+    return exit_code
 
 
 if __name__ == "__main__":
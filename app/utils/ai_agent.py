@@ -2,62 +2,296 @@
 AI Agent utilities for initializing and managing agents.
 """
 
+import functools
+import json
 import logging
-from typing import Dict, Optional
+import os
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from strands import Agent
 from strands.models.bedrock import BedrockModel
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # MODEL_NAME = "arn:aws:bedrock:eu-west-1:655604747460:inference-profile/eu.anthropic.claude-sonnet-4-5-20250929-v1:0"
 NOVA_2_OMNI = "global.amazon.nova-2-lite-v1:0"
 CLAUDE_3_7_SONNET = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
 CLAUDE_SONNET_4_5 = "us.anthropic.claude-sonnet-4-5-20250929-v1:0"
+CLAUDE_3_5_HAIKU = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
 
 MODEL_NAME = NOVA_2_OMNI
 
+# Model per task. Selecting documents from the prompt's shortlist does not need
+# Sonnet-tier reasoning; use a stronger model (e.g. CLAUDE_SONNET_4_5) for controls
+# with poor results. Keywords stay on the cheaper Nova model.
+SELECTION_MODEL = CLAUDE_3_5_HAIKU
+KEYWORDS_MODEL = MODEL_NAME
+
 # list of supported models are here https://docs.aws.amazon.com/bedrock/latest/userguide/inference-profiles-support.html#inference-profiles-support-system
 AWS_REGION = "us-east-1"  # US East (N. Virginia)
 
-# AWS Bedrock pricing per 1000 tokens (as of 2025)
-# Prices are in USD per 1000 tokens
+# Latency-optimized inference (BEDROCK_LATENCY_OPTIMIZED=1) is only available for some
+# models and regions, requests for others are retried without it
+LATENCY_OPTIMIZED = os.environ.get("BEDROCK_LATENCY_OPTIMIZED") == "1"
+LATENCY_OPTIMIZED_REQUEST_ARGS = {"performanceConfig": {"latency": "optimized"}}
+
+# Bedrock client configuration: throttled calls (many concurrent agent calls) are
+# retried with exponential backoff and client-side rate limiting
+BOTO_CLIENT_CONFIG = Config(retries={"max_attempts": 10, "mode": "adaptive"})
+
+# Bedrock prompt cache checkpoint, everything before it is cached as a prefix
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+# AWS Bedrock pricing (as of 2025), loaded from pricing.json next to this module:
+# {model_id: {"input_micro_per_mtok": ..., "output_micro_per_mtok": ...,
+#             "cache_read_micro_per_mtok": ..., "cache_write_micro_per_mtok": ...}}
+# plus a "default" entry for unknown models.
+# Prices are integer micro-dollars (USD 1e-6) per million tokens, so costs are summed
+# exactly in integers and converted to USD once
 # Source: https://aws.amazon.com/bedrock/pricing/
-# Note: Prices may vary by region and can change. Update these values as needed.
-BEDROCK_PRICING: Dict[str, Dict[str, float]] = {
-    # Claude 3.7 Sonnet
-    CLAUDE_3_7_SONNET: {
-        "input": 0.003,  # $0.003 per 1000 input tokens ($3.00 per million)
-        "output": 0.015,  # $0.015 per 1000 output tokens ($15.00 per million)
-    },
-    # Claude Sonnet 4.5 (inference profile)
-    CLAUDE_SONNET_4_5: {
-        "input": 0.003,  # $0.003 per 1000 input tokens ($3.00 per million)
-        "output": 0.015,  # $0.015 per 1000 output tokens ($15.00 per million)
-    },
-    # Amazon Nova 2 Omni (Preview)
-    NOVA_2_OMNI: {
-        "input": 0.0003,  # $0.0003 per 1000 input tokens ($0.30 per million)
-        "output": 0.0025,  # $0.0025 per 1000 output tokens ($2.50 per million)
-    },
-    # Default/fallback pricing (Claude 3.7 Sonnet)
-    "default": {
-        "input": 0.003,  # $0.003 per 1000 input tokens ($3.00 per million)
-        "output": 0.015,  # $0.015 per 1000 output tokens ($15.00 per million)
-    },
-}
+# Note: Prices may vary by region and can change. Update them with
+# python -m app.utils.update_pricing, running processes pick up the change.
+PRICING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pricing.json")
+# Prompt cache reads cost 0.1x and cache writes 1.25x the input price
+# (used when a model has no cache_read / cache_write price).
+CACHE_READ_PRICE_RATIO = (1, 10)
+CACHE_WRITE_PRICE_RATIO = (5, 4)
+PRICE_TOKENS = 1_000_000  # Number of tokens the prices are given for
+MICRODOLLARS_PER_USD = 1_000_000
+
+
+@functools.lru_cache(maxsize=1)
+def _load_pricing(path: str, mtime_ns: int) -> Dict[str, Dict[str, int]]:
+    """
+    Read the pricing file, memoized until its modification time changes.
+
+    Args:
+        path: The pricing file
+        mtime_ns: Modification time of the file, only used as part of the cache key
+
+    Returns:
+        Dictionary mapping model IDs (and "default") to their prices
+    """
+    with open(path, "rb") as f:
+        return json.load(f)
+
+
+def get_pricing(force_refresh: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    Get the Bedrock pricing from PRICING_PATH.
+
+    The file is read on first use and again only after its modification time changes.
+
+    Args:
+        force_refresh: Read the file even if it did not change
+
+    Returns:
+        Dictionary mapping model IDs (and "default") to their prices
+    """
+    if force_refresh:
+        _load_pricing.cache_clear()
+    return _load_pricing(PRICING_PATH, os.stat(PRICING_PATH).st_mtime_ns)
+
+
+def create_bedrock_model(
+    model_name=MODEL_NAME,
+    aws_region=AWS_REGION,
+    max_tokens: Optional[int] = None,
+) -> BedrockModel:
+    """
+    Create a BedrockModel, with latency-optimized inference if enabled.
+
+    Args:
+        model_name: The Bedrock model ID to use
+        aws_region: The AWS region for Bedrock
+        max_tokens: Maximum number of output tokens per call (model default if None)
+
+    Returns:
+        BedrockModel instance
+    """
+    model_config = {}
+    if max_tokens is not None:
+        model_config["max_tokens"] = max_tokens
+    if LATENCY_OPTIMIZED:
+        logger.info("Using latency-optimized inference")
+        model_config["additional_args"] = LATENCY_OPTIMIZED_REQUEST_ARGS
+    return BedrockModel(
+        model_id=model_name,
+        region_name=aws_region,
+        boto_client_config=BOTO_CLIENT_CONFIG,
+        **model_config,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_bedrock_model(
+    model_name: str,
+    aws_region: str,
+    max_tokens: int,
+) -> BedrockModel:
+    """
+    Get the shared BedrockModel for the given settings, creating it on first use.
+
+    A BedrockModel keeps no conversation state, so one instance (and its boto3
+    client) can serve many agents, also from several threads or tasks at once.
+
+    Args:
+        model_name: The Bedrock model ID to use
+        aws_region: The AWS region for Bedrock
+        max_tokens: Maximum number of output tokens per call
+
+    Returns:
+        BedrockModel instance
+    """
+    return create_bedrock_model(model_name, aws_region, max_tokens)
+
+
+def _find_client_error(error: BaseException) -> Optional[ClientError]:
+    """
+    Find the botocore ClientError in the exception chain (strands may wrap it).
+    """
+    while error is not None:
+        if isinstance(error, ClientError):
+            return error
+        error = error.__cause__
+    return None
+
+
+def _latency_optimized(agent: Agent) -> bool:
+    """
+    Check whether the agent model currently requests latency-optimized inference.
+
+    Must be checked before the call: the model is shared, so a concurrent call may
+    disable latency optimization while this call is in flight.
+    """
+    return "additional_args" in agent.model.config
+
+
+def _disable_rejected_latency_optimization(
+    agent: Agent, error: Exception, latency_optimized: bool
+) -> bool:
+    """
+    Drop latency-optimized inference from the agent model if Bedrock rejected it.
+
+    Args:
+        agent: The agent whose call failed
+        error: The exception raised by the call
+        latency_optimized: Whether the call was made with latency-optimized inference
+            (see _latency_optimized)
+
+    Returns:
+        True if the call should be retried, False if the error is unrelated
+    """
+    client_error = _find_client_error(error)
+    if (
+        not latency_optimized
+        or client_error is None
+        or client_error.response.get("Error", {}).get("Code") != "ValidationException"
+    ):
+        return False
+    logger.warning(
+        f"Latency-optimized inference rejected ({client_error}), retrying without it"
+    )
+    # Another call sharing the model may have removed it already
+    agent.model.config.pop("additional_args", None)
+    return True
+
+
+def invoke_agent(agent: Agent, prompt):
+    """
+    Call the agent, retrying without latency-optimized inference if Bedrock rejects it.
+
+    Args:
+        agent: The agent to call
+        prompt: The prompt to send
+
+    Returns:
+        AgentResult of the call
+    """
+    messages = list(agent.messages)
+    latency_optimized = _latency_optimized(agent)
+    try:
+        return agent(prompt)
+    except Exception as e:
+        if not _disable_rejected_latency_optimization(agent, e, latency_optimized):
+            raise
+        agent.messages = messages
+        return agent(prompt)
+
+
+async def invoke_agent_async(agent: Agent, prompt):
+    """
+    Asynchronous version of invoke_agent.
+
+    Args:
+        agent: The agent to call
+        prompt: The prompt to send
+
+    Returns:
+        AgentResult of the call
+    """
+    messages = list(agent.messages)
+    latency_optimized = _latency_optimized(agent)
+    try:
+        return await agent.invoke_async(prompt)
+    except Exception as e:
+        if not _disable_rejected_latency_optimization(agent, e, latency_optimized):
+            raise
+        agent.messages = messages
+        return await agent.invoke_async(prompt)
+
+
+async def stream_agent(agent: Agent, prompt) -> AsyncIterator[str]:
+    """
+    Stream the text generated by the agent as it arrives.
+
+    Like invoke_agent, the call is retried without latency-optimized inference if
+    Bedrock rejects it before any text was streamed.
+
+    Args:
+        agent: The agent to call
+        prompt: The prompt to send
+
+    Yields:
+        Text chunks of the agent response
+    """
+    messages = list(agent.messages)
+    latency_optimized = _latency_optimized(agent)
+    streamed = False
+    try:
+        async for event in agent.stream_async(prompt):
+            if "data" in event:
+                streamed = True
+                yield event["data"]
+        return
+    except Exception as e:
+        if streamed or not _disable_rejected_latency_optimization(
+            agent, e, latency_optimized
+        ):
+            raise
+    agent.messages = messages
+    async for event in agent.stream_async(prompt):
+        if "data" in event:
+            yield event["data"]
 
 
 def initialize_agent(
     model_name=MODEL_NAME,
     aws_region=AWS_REGION,
+    max_tokens: Optional[int] = None,
+    system_prompt: Optional[str] = None,
 ):
     """
-    Initialize an Agent.
+    Initialize an Agent with a fresh conversation on the shared BedrockModel of the
+    given settings (see get_bedrock_model), so it is cheap to create one per call.
 
     Args:
         model_name: The Bedrock model ID to use
         aws_region: The AWS region for Bedrock
+        max_tokens: Maximum number of output tokens per call (model default if None)
+        system_prompt: Static instructions, sent as a system prompt followed by a
+            cache point so repeated calls read them from the Bedrock prompt cache
 
     Returns:
         Initialized Agent instance
@@ -66,53 +300,72 @@ def initialize_agent(
         Exception: If initialization fails
     """
     try:
-        logger.info("Initializing Agent...")
-        logger.info(f"Using model: {model_name}")
-        logger.info(f"Using AWS region: {aws_region}")
-        # Create BedrockModel with specific region
-        bedrock_model = BedrockModel(
-            model_id=model_name,
-            region_name=aws_region,
-        )
+        logger.debug("Initializing Agent...")
+        logger.debug("Using model: %s", model_name)
+        logger.debug("Using AWS region: %s", aws_region)
+        # Shared BedrockModel with specific region
+        bedrock_model = get_bedrock_model(model_name, aws_region, max_tokens)
         agent = Agent(
             model=bedrock_model,
             tools=[],
+            system_prompt=(
+                [{"text": system_prompt}, CACHE_POINT] if system_prompt else None
+            ),
         )
         # agent.verbose = True
-        logger.info("Agent initialized successfully")
+        logger.debug("Agent initialized successfully")
         return agent
     except Exception as e:
         logger.error(f"Failed to initialize Agent: {str(e)}", exc_info=True)
         raise e
 
 
+def add_usage(total: Dict[str, int], usage: Dict[str, int]) -> None:
+    """
+    Add token usage counters (inputTokens, outputTokens, ...) to a running total.
+
+    Args:
+        total: Accumulated usage, updated in place
+        usage: Usage of a single agent
+    """
+    for key, value in usage.items():
+        total[key] = total.get(key, 0) + value
+
+
 def calculate_token_cost(
     usage: Dict[str, int],
     model_name: Optional[str] = None,
-    pricing: Optional[Dict[str, Dict[str, float]]] = None,
+    pricing: Optional[Dict[str, Dict[str, int]]] = None,
 ) -> Dict[str, float]:
     """
     Calculate the cost of token usage based on AWS Bedrock pricing.
 
+    Costs are computed in integers and converted to USD at the end, so the cost of
+    summed usage (see aggregate_costs) equals the sum of the individual costs.
+
     Args:
         usage: Dictionary with token usage information containing:
-            - inputTokens: Number of input tokens
+            - inputTokens: Number of input tokens (not read from or written to the cache)
             - outputTokens: Number of output tokens
             - totalTokens: Total tokens (optional, calculated if not provided)
+            - cacheReadInputTokens: Input tokens read from the prompt cache (optional)
+            - cacheWriteInputTokens: Input tokens written to the prompt cache (optional)
         model_name: Model identifier to look up pricing. If None, uses default pricing.
-        pricing: Optional custom pricing dictionary. If None, uses BEDROCK_PRICING.
+        pricing: Optional custom pricing dictionary. If None, uses get_pricing().
 
     Returns:
         Dictionary with cost breakdown:
             - input_cost: Cost for input tokens in USD
             - output_cost: Cost for output tokens in USD
+            - cache_read_cost: Cost for cache read tokens in USD
+            - cache_write_cost: Cost for cache write tokens in USD
             - total_cost: Total cost in USD
             - input_tokens: Number of input tokens
             - output_tokens: Number of output tokens
             - total_tokens: Total number of tokens
     """
     if pricing is None:
-        pricing = BEDROCK_PRICING
+        pricing = get_pricing()
 
     # Get pricing for the model, or use default
     model_pricing = pricing.get(model_name or MODEL_NAME, pricing.get("default", {}))
@@ -120,42 +373,105 @@ def calculate_token_cost(
         logger.warning(
             f"No pricing found for model {model_name or MODEL_NAME}, using default"
         )
-        model_pricing = pricing.get("default", {"input": 0.003, "output": 0.015})
+        model_pricing = pricing.get(
+            "default",
+            {"input_micro_per_mtok": 3_000_000, "output_micro_per_mtok": 15_000_000},
+        )
 
     input_tokens = usage.get("inputTokens", 0)
     output_tokens = usage.get("outputTokens", 0)
-    total_tokens = usage.get("totalTokens", input_tokens + output_tokens)
 
-    # Calculate costs (pricing is per 1000 tokens)
-    input_cost = (input_tokens / 1_000) * model_pricing.get("input", 0)
-    output_cost = (output_tokens / 1_000) * model_pricing.get("output", 0)
-    total_cost = input_cost + output_cost
+    input_price = model_pricing.get("input_micro_per_mtok", 0)
+    prices = (
+        input_price,
+        model_pricing.get("output_micro_per_mtok", 0),
+        model_pricing.get(
+            "cache_read_micro_per_mtok",
+            input_price * CACHE_READ_PRICE_RATIO[0] // CACHE_READ_PRICE_RATIO[1],
+        ),
+        model_pricing.get(
+            "cache_write_micro_per_mtok",
+            input_price * CACHE_WRITE_PRICE_RATIO[0] // CACHE_WRITE_PRICE_RATIO[1],
+        ),
+    )
+    tokens = (
+        input_tokens,
+        output_tokens,
+        usage.get("cacheReadInputTokens", 0),
+        usage.get("cacheWriteInputTokens", 0),
+    )
+    input_cost, output_cost, cache_read_cost, cache_write_cost = _token_costs(
+        tokens, prices
+    )
+    usd = PRICE_TOKENS * MICRODOLLARS_PER_USD
 
     return {
-        "input_cost": input_cost,
-        "output_cost": output_cost,
-        "total_cost": total_cost,
+        "input_cost": input_cost / usd,
+        "output_cost": output_cost / usd,
+        "cache_read_cost": cache_read_cost / usd,
+        "cache_write_cost": cache_write_cost / usd,
+        "total_cost": (input_cost + output_cost + cache_read_cost + cache_write_cost)
+        / usd,
         "input_tokens": input_tokens,
         "output_tokens": output_tokens,
-        "total_tokens": total_tokens,
+        "total_tokens": usage.get("totalTokens", input_tokens + output_tokens),
     }
 
 
-def print_agent_usage(agent: Agent) -> None:
+@functools.lru_cache(maxsize=1024)
+def _token_costs(
+    tokens: Tuple[int, int, int, int], prices: Tuple[int, int, int, int]
+) -> Tuple[int, ...]:
+    """
+    Calculate the exact costs of (input, output, cache read, cache write) tokens.
+
+    Memoized on the token counts and prices, which repeat a lot when the usage of many
+    similar calls is priced. Costs are in micro-dollars times PRICE_TOKENS.
+    """
+    return tuple(count * price for count, price in zip(tokens, prices))
+
+
+def aggregate_costs(
+    usages: Iterable[Dict[str, int]],
+    model_name: Optional[str] = None,
+    pricing: Optional[Dict[str, Dict[str, int]]] = None,
+) -> Dict[str, float]:
+    """
+    Calculate the total cost of the token usage of several calls.
+
+    The token counts are summed first and priced once, which is exact because the
+    prices are integers.
+
+    Args:
+        usages: Token usage of every call (see calculate_token_cost)
+        model_name: Model identifier to look up pricing. If None, uses default pricing.
+        pricing: Optional custom pricing dictionary. If None, uses get_pricing().
+
+    Returns:
+        Cost breakdown of the summed usage (see calculate_token_cost)
     """
-    Print the details of the token usage by the agent.
+    total: Dict[str, int] = {}
+    for usage in usages:
+        add_usage(total, usage)
+    return calculate_token_cost(total, model_name=model_name, pricing=pricing)
+
+
+def print_agent_usage(model_id: str, usage: Dict[str, int]) -> None:
+    """
+    Print the details of the token usage of a model.
+
+    Only formats usage that was already recorded, it never calls the model.
+
+    Args:
+        model_id: The Bedrock model ID, used to look up the pricing
+        usage: Token usage to print, e.g. accumulated by the caller over several
+            agents with add_usage
     """
-    result = agent("a")
-    # print details of the token usage by the agent
     print("Agent details:")
     print("--------------------------------")
-    print(f"Model: {agent.model}")
-    print("--------------------------------")
-    print(f"Model config: {agent.model.config}")
+    print(f"Model: {model_id}")
     print("--------------------------------")
 
-    # Token usage is in result.metrics.accumulated_usage
-    usage = result.metrics.accumulated_usage
     print("Token usage:")
     print("--------------------------------")
     print(f"Input tokens: {usage.get('inputTokens', 0):,}")
@@ -168,10 +484,13 @@ def print_agent_usage(agent: Agent) -> None:
     print("--------------------------------")
 
     # Calculate and display costs
-    cost_info = calculate_token_cost(usage, model_name=MODEL_NAME)
+    cost_info = calculate_token_cost(usage, model_name=model_id)
     print("Cost breakdown:")
     print("--------------------------------")
     print(f"Input cost: ${cost_info['input_cost']:.6f}")
     print(f"Output cost: ${cost_info['output_cost']:.6f}")
+    if cost_info["cache_read_cost"] or cost_info["cache_write_cost"]:
+        print(f"Cache read cost: ${cost_info['cache_read_cost']:.6f}")
+        print(f"Cache write cost: ${cost_info['cache_write_cost']:.6f}")
     print(f"Total cost: ${cost_info['total_cost']:.6f}")
     print("--------------------------------")
@@ -0,0 +1,121 @@
+"""
+Update the Bedrock prices of a model in pricing.json.
+
+Prices are given in USD per million tokens, as listed on https://aws.amazon.com/bedrock/pricing/
+
+    python -m app.utils.update_pricing us.anthropic.claude-3-5-haiku-20241022-v1:0 \\
+        --input 0.80 --output 4.00 --cache-read 0.08 --cache-write 1.00
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from decimal import Decimal
+
+from app.utils.ai_agent import MICRODOLLARS_PER_USD, PRICING_PATH, get_pricing
+
+logger = logging.getLogger(__name__)
+
+# Command line option -> pricing.json key
+PRICE_OPTIONS = {
+    "input": "input_micro_per_mtok",
+    "output": "output_micro_per_mtok",
+    "cache_read": "cache_read_micro_per_mtok",
+    "cache_write": "cache_write_micro_per_mtok",
+}
+
+
+def usd_to_micro(price: Decimal) -> int:
+    """
+    Convert a price in USD to integer micro-dollars.
+
+    Args:
+        price: Price in USD (e.g. Decimal("0.375"))
+
+    Returns:
+        The price in micro-dollars, rounded to the nearest one
+    """
+    return int((price * MICRODOLLARS_PER_USD).to_integral_value())
+
+
+def save_pricing(pricing: dict, path: str = PRICING_PATH) -> None:
+    """
+    Save the pricing to a file.
+
+    The file is replaced atomically, so running processes never read a partial file.
+
+    Args:
+        pricing: Dictionary mapping model IDs (and "default") to their prices
+        path: The pricing file
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pricing, f, indent=4)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def parse_args():
+    """
+    Parse the command line arguments.
+
+    Returns:
+        Namespace with model_id, remove and the prices in USD per million tokens
+        (input, output, cache_read, cache_write; None if not given)
+    """
+    parser = argparse.ArgumentParser(
+        description="Update the Bedrock prices (USD per million tokens) of a model."
+    )
+    parser.add_argument(
+        "model_id", help='Bedrock model ID, or "default" for unknown models'
+    )
+    for option in PRICE_OPTIONS:
+        parser.add_argument(
+            f"--{option.replace('_', '-')}",
+            dest=option,
+            type=Decimal,
+            help=f"{option.replace('_', ' ').capitalize()} price in USD per million tokens",
+        )
+    parser.add_argument(
+        "--remove", action="store_true", help="Remove the prices of the model"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """
+    Set or remove the prices of a model in the pricing file.
+
+    Exits with status 1 if no price is given, or if the model to remove has no prices.
+    """
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    pricing = dict(get_pricing(force_refresh=True))
+
+    if args.remove:
+        if pricing.pop(args.model_id, None) is None:
+            logger.error("No pricing found for model %s", args.model_id)
+            sys.exit(1)
+        save_pricing(pricing)
+        logger.info("Removed pricing of model %s", args.model_id)
+        return
+
+    prices = {
+        key: usd_to_micro(getattr(args, option))
+        for option, key in PRICE_OPTIONS.items()
+        if getattr(args, option) is not None
+    }
+    if not prices:
+        logger.error("No prices given, use --input, --output, --cache-read or --cache-write")
+        sys.exit(1)
+
+    pricing[args.model_id] = {**pricing.get(args.model_id, {}), **prices}
+    save_pricing(pricing)
+    logger.info("Updated pricing of model %s: %s", args.model_id, pricing[args.model_id])
+
+
+if __name__ == "__main__":
+    main()
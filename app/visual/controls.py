@@ -1,29 +1,61 @@
+from operator import attrgetter
 from pathlib import Path
-from typing import List, Optional
+from typing import Optional
+import os
 import re
 
+from app.visual.index import Index
+
+# Pattern to match filenames starting with a control ID (e.g., "5.1", "8.2")
+# Format: {number}.{number} {rest of name}.md
+_CONTROL_FILENAME_RE = re.compile(r"^(\d+\.\d+)\s+(.+?)\.md$")
+
 
 class Control:
     """Model representing a control document."""
 
-    def __init__(self, id: str, name: str, content: str):
+    __slots__ = ("id", "name", "path", "_content", "_sort_key")
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        content: Optional[str] = None,
+        path: Optional[Path] = None,
+    ):
         """
         Initialize a Control object.
 
         Args:
             id: The control ID (e.g., "5.1", "8.2")
             name: The control name (remaining part of filename)
-            content: The full content of the control document
+            content: The full content of the control document (read from path on
+                first access if not provided)
+            path: Path to the control file
         """
         self.id = id
         self.name = name
-        self.content = content
+        # Numeric sort key parsed once, e.g. "8.12" -> (8, 12)
+        self._sort_key = tuple(int(part) for part in id.split("."))
+        self.path = path
+        self._content = content
+
+    @property
+    def content(self) -> str:
+        """The full content of the control document, read from the file on first access."""
+        if self._content is None and self.path is not None:
+            self._content = self.path.read_text(encoding="utf-8")
+        return self._content
 
     def __repr__(self):
         return f"Control(id='{self.id}', name='{self.name}')"
 
 
-def load_controls(controls_dir: str) -> List[Control]:
+# Controls sorted by ID with a constant time lookup by ID
+ControlIndex = Index[Control]
+
+
+def load_controls(controls_dir: str) -> ControlIndex:
     """
     Load all control files from the specified directory.
 
@@ -34,7 +66,7 @@ def load_controls(controls_dir: str) -> List[Control]:
         controls_dir: Path to the directory containing control files
 
     Returns:
-        List of Control objects
+        ControlIndex of the Control objects, sorted by ID
     """
     controls = []
     controls_path = Path(controls_dir)
@@ -42,51 +74,49 @@ def load_controls(controls_dir: str) -> List[Control]:
     if not controls_path.exists():
         raise FileNotFoundError(f"Controls directory not found: {controls_dir}")
 
-    # Pattern to match filenames starting with a control ID (e.g., "5.1", "8.2")
-    # Format: {number}.{number} {rest of name}.md
-    pattern = re.compile(r"^(\d+\.\d+)\s+(.+?)\.md$")
-
     # Iterate through all .md files in the directory
-    for file_path in controls_path.glob("*.md"):
-        filename = file_path.name
-        match = pattern.match(filename)
-
-        if match:
-            control_id = match.group(1)
-            control_name = match.group(2)
-
-            # Read the file content
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-
-                control = Control(id=control_id, name=control_name, content=content)
+    with os.scandir(controls_path) as entries:
+        for entry in entries:
+            filename = entry.name
+            # Visible markdown files, as matched by Path.glob("*.md")
+            if (
+                not filename.endswith(".md")
+                or filename.startswith(".")
+                or not entry.is_file()
+            ):
+                continue
+
+            match = _CONTROL_FILENAME_RE.match(filename)
+
+            if match:
+                control_id = match.group(1)
+                control_name = match.group(2)
+
+                # The name comes from the filename, the content is loaded on demand
+                control = Control(
+                    id=control_id, name=control_name, path=Path(entry.path)
+                )
                 controls.append(control)
-            except Exception as e:
-                print(f"Warning: Could not read file {filename}: {e}")
-        else:
-            print(
-                f"Warning: Filename '{filename}' does not match expected pattern (ID Name.md)"
-            )
+            else:
+                print(
+                    f"Warning: Filename '{filename}' does not match expected pattern (ID Name.md)"
+                )
 
     # Sort controls by ID for consistency
-    controls.sort(key=lambda x: (float(x.id.split(".")[0]), float(x.id.split(".")[1])))
+    controls.sort(key=attrgetter("_sort_key"))
 
-    return controls
+    return Index(controls)
 
 
-def get_control_by_id(controls: List[Control], control_id: str) -> Optional[Control]:
+def get_control_by_id(controls: ControlIndex, control_id: str) -> Optional[Control]:
     """
     Get a control by its ID.
 
     Args:
-        controls: List of Control objects
+        controls: ControlIndex returned by load_controls
         control_id: The ID to search for (e.g., "5.1", "8.2")
 
     Returns:
         Control object if found, None otherwise
     """
-    for control in controls:
-        if control.id == control_id:
-            return control
-    return None
+    return controls.get(control_id)
@@ -1,29 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import Optional
+import os
 import re
 
+from app.visual.index import Index
+
+# Number of threads used to read files in parallel
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Pattern to match filenames with numeric IDs (e.g., "1205665906.md")
+_DOC_FILENAME_RE = re.compile(r"^(\d+)\.md$")
+
 
 class Document:
     """Model representing a document."""
 
-    def __init__(self, id: str, name: str, content: str):
+    __slots__ = ("id", "name", "path", "_content")
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        content: Optional[str] = None,
+        path: Optional[Path] = None,
+    ):
         """
         Initialize a Document object.
 
         Args:
             id: The document ID (e.g., "1205665906", "170098836")
             name: The document name (extracted from first heading)
-            content: The full content of the document
+            content: The full content of the document (read from path on first access
+                if not provided)
+            path: Path to the document file
         """
         self.id = id
         self.name = name
-        self.content = content
+        self.path = path
+        self._content = content
+
+    @property
+    def content(self) -> str:
+        """The full content of the document, read from the file on first access."""
+        if self._content is None and self.path is not None:
+            self._content = self.path.read_text(encoding="utf-8")
+        return self._content
 
     def __repr__(self):
         return f"Document(id='{self.id}', name='{self.name}')"
 
 
-def load_documents(documents_dir: str) -> List[Document]:
+def _load_document(file_path: Path, document_id: str) -> Optional[Document]:
+    """
+    Create a Document from a file, reading only its first non-empty line.
+
+    Args:
+        file_path: Path to the document file
+        document_id: The document ID taken from the filename
+
+    Returns:
+        Document object, or None if the file could not be read
+    """
+    # Read only the first non-empty line, the content is loaded on demand
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            first_line = ""
+            for line in f:
+                first_line = line.strip()
+                if first_line:
+                    break
+    except Exception as e:
+        print(f"Warning: Could not read file {file_path.name}: {e}")
+        return None
+
+    # Extract document name from the first line
+    # The first line should be a markdown heading starting with #
+    document_name = ""
+    if first_line:
+        if first_line.startswith("#"):
+            # Remove the # and any leading/trailing whitespace
+            document_name = first_line.lstrip("#").strip()
+        else:
+            # If first line doesn't start with #, use it as-is
+            document_name = first_line
+
+    # If no name found, use the document ID as fallback
+    if not document_name:
+        document_name = document_id
+
+    return Document(id=document_id, name=document_name, path=file_path)
+
+
+# Documents sorted by ID with a constant time lookup by ID
+DocumentIndex = Index[Document]
+
+
+def load_documents(documents_dir: str) -> DocumentIndex:
     """
     Load all document files from the specified directory.
 
@@ -34,76 +107,62 @@ def load_documents(documents_dir: str) -> List[Document]:
         documents_dir: Path to the directory containing document files
 
     Returns:
-        List of Document objects
+        DocumentIndex of the Document objects, sorted by ID
     """
-    documents = []
     documents_path = Path(documents_dir)
 
     if not documents_path.exists():
         raise FileNotFoundError(f"Documents directory not found: {documents_dir}")
 
-    # Pattern to match filenames with numeric IDs (e.g., "1205665906.md")
-    pattern = re.compile(r"^(\d+)\.md$")
-
     # Iterate through all .md files in the directory
-    for file_path in documents_path.glob("*.md"):
-        filename = file_path.name
-        match = pattern.match(filename)
-
-        if match:
-            document_id = match.group(1)
-
-            # Read the file content
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-
-                # Extract document name from the first line
-                # The first line should be a markdown heading starting with #
-                lines = content.split("\n")
-                document_name = ""
-                if lines:
-                    first_line = lines[0].strip()
-                    if first_line.startswith("#"):
-                        # Remove the # and any leading/trailing whitespace
-                        document_name = first_line.lstrip("#").strip()
-                    else:
-                        # If first line doesn't start with #, use it as-is
-                        document_name = first_line
-
-                # If no name found, use the document ID as fallback
-                if not document_name:
-                    document_name = document_id
-
-                document = Document(id=document_id, name=document_name, content=content)
-                documents.append(document)
-            except Exception as e:
-                print(f"Warning: Could not read file {filename}: {e}")
-        else:
-            print(
-                f"Warning: Filename '{filename}' does not match expected pattern (numeric ID.md)"
+    matched_files = []
+    with os.scandir(documents_path) as entries:
+        for entry in entries:
+            filename = entry.name
+            # Visible markdown files, as matched by Path.glob("*.md")
+            if (
+                not filename.endswith(".md")
+                or filename.startswith(".")
+                or not entry.is_file()
+            ):
+                continue
+
+            match = _DOC_FILENAME_RE.match(filename)
+
+            if match:
+                matched_files.append((Path(entry.path), match.group(1)))
+            else:
+                print(
+                    f"Warning: Filename '{filename}' does not match expected pattern (numeric ID.md)"
+                )
+
+    # Read the headings in parallel, the threads release the GIL while waiting on disk
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        documents = [
+            document
+            for document in executor.map(
+                lambda args: _load_document(*args), matched_files
             )
+            if document is not None
+        ]
 
     # Sort documents by ID (as integer) for consistency
     documents.sort(key=lambda x: int(x.id))
 
-    return documents
+    return Index(documents)
 
 
 def get_document_by_id(
-    documents: List[Document], document_id: str
+    documents: DocumentIndex, document_id: str
 ) -> Optional[Document]:
     """
     Get a document by its ID.
 
     Args:
-        documents: List of Document objects
+        documents: DocumentIndex returned by load_documents
         document_id: The ID to search for (e.g., "1205665906", "170098836")
 
     Returns:
         Document object if found, None otherwise
     """
-    for document in documents:
-        if document.id == document_id:
-            return document
-    return None
+    return documents.get(document_id)
@@ -0,0 +1,37 @@
+from typing import Generic, Iterator, List, Optional, TypeVar
+
+# Any item with an "id" attribute (Control, Document)
+T = TypeVar("T")
+
+
+class Index(Generic[T]):
+    """Items sorted by ID with a constant time lookup by ID."""
+
+    __slots__ = ("items", "_by_id")
+
+    def __init__(self, items: List[T]):
+        """
+        Initialize an Index object.
+
+        Args:
+            items: List of objects with an "id" attribute, in the iteration order of
+                the index
+        """
+        self.items = items
+        self._by_id = {item.id: item for item in items}
+
+    def get(self, item_id: str) -> Optional[T]:
+        """Get an item by its ID (e.g., "5.1" or "1205665906"), or None if not found."""
+        return self._by_id.get(item_id)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index: int) -> T:
+        return self.items[index]
+
+    def __repr__(self):
+        return f"Index(items={len(self.items)})"
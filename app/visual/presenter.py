@@ -1,11 +1,17 @@
+import functools
 import logging
-from typing import List
-from app.visual.controls import Control, load_controls
-from app.visual.documents import Document, load_documents
+import os
+from typing import Dict, List, Optional, Set
+from app.visual.controls import ControlIndex, load_controls
+from app.visual.documents import DocumentIndex, load_documents
 from app.visual.selected_documents import SelectedControl, load_selected_controls
 import dash
-from dash import callback, Input, Output, State
-from app.visual.presenter_layout import update_layout
+from dash import Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask.json.provider import DefaultJSONProvider
+import orjson
+import plotly.io
+from app.visual.presenter_layout import DASH_STYLESHEET, update_layout
 
 
 logging.basicConfig(level=logging.INFO)
@@ -16,57 +22,210 @@ CONTROLS_DIR = "controls"
 DOCUMENTS_DIR = "documents"
 SELECTED_DOCUMENTS_DIR = "selected_documents_agent"
 
+# Opacity of the nodes that do not match the keywords
+DIMMED_OPACITY = 0.15
 
-@callback(
-    Output("cytoscape-graph", "elements"),
-    Input("input-keywords", "value"),
-    State("cytoscape-graph", "elements"),
-)
-def update_elements(
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider parsing the callback requests with orjson."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def get_directory_mtime_ns(directory: str) -> int:
+    """Return the latest modification time of a directory and its markdown files."""
+    with os.scandir(directory) as entries:
+        return max(
+            [os.stat(directory).st_mtime_ns]
+            + [
+                entry.stat().st_mtime_ns
+                for entry in entries
+                if entry.name.endswith(".md") and not entry.name.startswith(".")
+            ]
+        )
+
+
+@functools.lru_cache(maxsize=4)
+def _load_controls_cached(controls_dir: str, mtime_ns: int) -> ControlIndex:
+    return load_controls(controls_dir)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_documents_cached(documents_dir: str, mtime_ns: int) -> DocumentIndex:
+    return load_documents(documents_dir)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_selected_controls_cached(
+    selected_documents_dir: str,
+    mtime_ns: int,
+    documents_dir: str,
+    documents_mtime_ns: int,
+) -> List[SelectedControl]:
+    documents = _load_documents_cached(documents_dir, documents_mtime_ns)
+    return load_selected_controls(selected_documents_dir, documents)
+
+
+def load_controls_cached(controls_dir: str) -> ControlIndex:
+    """Load controls, reusing the previous result while the directory is unchanged."""
+    return _load_controls_cached(controls_dir, get_directory_mtime_ns(controls_dir))
+
+
+def load_documents_cached(documents_dir: str) -> DocumentIndex:
+    """Load documents, reusing the previous result while the directory is unchanged."""
+    return _load_documents_cached(documents_dir, get_directory_mtime_ns(documents_dir))
+
+
+def load_selected_controls_cached(
+    selected_documents_dir: str, documents_dir: str
+) -> List[SelectedControl]:
+    """
+    Load selected controls, reusing the previous result while both directories are
+    unchanged.
+    """
+    return _load_selected_controls_cached(
+        selected_documents_dir,
+        get_directory_mtime_ns(selected_documents_dir),
+        documents_dir,
+        get_directory_mtime_ns(documents_dir),
+    )
+
+
+def build_node_labels(elements: List[Dict]) -> Dict[str, str]:
+    """
+    Build the index used to filter the nodes by keywords.
+
+    Args:
+        elements: Graph elements (see create_elements)
+
+    Returns:
+        Dictionary mapping the node ids to their lowercase labels
+    """
+    return {
+        element["data"]["id"]: element["data"]["label"].lower()
+        for element in elements
+        if "source" not in element["data"]
+    }
+
+
+def find_matching_nodes(
+    input_keywords: str, node_labels: Dict[str, str]
+) -> Optional[Set[str]]:
+    """
+    Find the ids of the nodes whose label contains all the keywords.
+
+    Args:
+        input_keywords: Space separated keywords
+        node_labels: Lowercase node labels by node id (see build_node_labels)
+
+    Returns:
+        Ids of the matching nodes, or None when there are no keywords (every node
+        matches)
+    """
+    keywords = input_keywords.lower().split() if input_keywords else []
+    if not keywords:
+        return None
+
+    return {
+        node_id
+        for node_id, label in node_labels.items()
+        if all(keyword in label for keyword in keywords)
+    }
+
+
+def update_stylesheet(
     input_keywords,
-    elements,
+    stylesheet,
+    node_labels: Dict[str, str],
 ):
-    if not input_keywords:
-        return elements
+    """
+    Dim the nodes that do not match the keywords.
+
+    Only the stylesheet is sent back, the elements and the layout are left untouched.
+    """
+    matching_ids = find_matching_nodes(input_keywords, node_labels)
+
+    new_stylesheet = list(DASH_STYLESHEET)
+    if matching_ids is not None:
+        new_stylesheet.append(
+            {"selector": "node", "style": {"opacity": DIMMED_OPACITY}}
+        )
+        if matching_ids:
+            new_stylesheet.append(
+                {
+                    "selector": ", ".join(
+                        f'node[id = "{node_id}"]' for node_id in sorted(matching_ids)
+                    ),
+                    "style": {"opacity": 1},
+                }
+            )
 
-    print(f"input_keywords: {input_keywords}. This is not implemented yet.")
+    if new_stylesheet == stylesheet:
+        raise PreventUpdate
 
-    return elements
+    return new_stylesheet
+
+
+def register_callbacks(app: dash.Dash, node_labels: Dict[str, str]) -> None:
+    """
+    Register the presenter callbacks on the app.
+
+    Args:
+        app: The Dash app
+        node_labels: Lowercase node labels by node id (see build_node_labels)
+    """
+
+    @app.callback(
+        Output("cytoscape-graph", "stylesheet"),
+        Input("input-keywords", "value"),
+        State("cytoscape-graph", "stylesheet"),
+    )
+    def update_graph_stylesheet(input_keywords, stylesheet):
+        return update_stylesheet(input_keywords, stylesheet, node_labels)
 
 
 def create_elements(
-    controls: List[Control],
-    documents: List[Document],
+    controls: ControlIndex,
+    documents: DocumentIndex,
     selected_controls: List[SelectedControl],
 ):
-    elements = []
-    for control in controls:
-        elements.append(
-            {
-                "data": {
-                    "id": control.id,
-                    "label": f"{control.id} {control.name}",
-                    "classes": "Control",
-                }
-            },
-        )
-    for document in documents:
-        elements.append(
-            {"data": {"id": document.id, "label": document.name}, "classes": "Document"}
-        )
+    nodes = [
+        {
+            "data": {
+                "id": control.id,
+                "label": f"{control.id} {control.name}",
+                "classes": "Control",
+            }
+        }
+        for control in controls
+    ] + [
+        {"data": {"id": document.id, "label": document.name}, "classes": "Document"}
+        for document in documents
+    ]
 
-    for selected_control in selected_controls:
-        for relevant_document_id in selected_control.relevant_document_ids:
-            elements.append(
-                {
-                    "data": {
-                        "source": selected_control.id,
-                        "target": relevant_document_id,
-                    }
-                }
-            )
+    # Edges to documents that are not loaded would be dangling in the graph
+    document_ids = {document.id for document in documents}
+    edges = [
+        {
+            "data": {
+                "source": selected_control.id,
+                "target": relevant_document_id,
+            }
+        }
+        for selected_control in selected_controls
+        for relevant_document_id in selected_control.relevant_document_ids
+        if relevant_document_id in document_ids
+    ]
 
-    return elements
+    return nodes + edges
 
 
 def main():
@@ -77,7 +236,7 @@ def main():
     logger.info("Presenter started successfully.")
 
     # Load controls
-    controls = load_controls(CONTROLS_DIR)
+    controls = load_controls_cached(CONTROLS_DIR)
     logger.info(f"Loaded {len(controls)} controls.")
 
     control = controls[0]
@@ -85,7 +244,7 @@ def main():
     logger.info(f"Control ID: {control.id}")
 
     # Load documents
-    documents = load_documents(DOCUMENTS_DIR)
+    documents = load_documents_cached(DOCUMENTS_DIR)
     logger.info(f"Loaded {len(documents)} documents.")
 
     document = documents[0]
@@ -95,7 +254,9 @@ def main():
     # Load selected documents
 
     # Load selected controls and map them to documents
-    selected_controls = load_selected_controls(SELECTED_DOCUMENTS_DIR, documents)
+    selected_controls = load_selected_controls_cached(
+        SELECTED_DOCUMENTS_DIR, DOCUMENTS_DIR
+    )
     logger.info(f"Loaded {len(selected_controls)} selected controls.")
     selected_control = selected_controls[2]
     logger.info(f"Selected control: {selected_control.name}")
@@ -107,10 +268,15 @@ def main():
     elements = create_elements(controls, documents, selected_controls)
     # elements = create_elements(controls, documents, selected_controls)
     # input_keywords = None
-    # filtered_elements = update_elements(input_keywords, elements)
+    # stylesheet = update_stylesheet(input_keywords, DASH_STYLESHEET, node_labels)
 
+    # Dash serializes the layout and the callback responses with the plotly JSON
+    # engine, and parses the callback requests with the Flask JSON provider
+    plotly.io.json.config.default_engine = "orjson"
     app = dash.Dash(__name__)
+    app.server.json = OrjsonProvider(app.server)
     update_layout(app, elements)
+    register_callbacks(app, build_node_labels(elements))
 
     app.run_server(debug=True)
 
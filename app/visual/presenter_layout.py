@@ -1,9 +1,5 @@
 import logging
-from typing import List
 
-from app.visual.controls import Control
-from app.visual.documents import Document
-from app.visual.selected_documents import SelectedControl
 from dash import html, dcc
 import dash_cytoscape as cyto
 
@@ -16,41 +12,6 @@ DOCUMENTS_DIR = "documents"
 SELECTED_DOCUMENTS_DIR = "selected_documents_agent"
 
 
-def create_elements(
-    controls: List[Control],
-    documents: List[Document],
-    selected_controls: List[SelectedControl],
-):
-    elements = []
-    for control in controls:
-        elements.append(
-            {
-                "data": {
-                    "id": control.id,
-                    "label": f"{control.id} {control.name}",
-                    "classes": "Control",
-                }
-            },
-        )
-    for document in documents:
-        elements.append(
-            {"data": {"id": document.id, "label": document.name}, "classes": "Document"}
-        )
-
-    for selected_control in selected_controls:
-        for relevant_document_id in selected_control.relevant_document_ids:
-            elements.append(
-                {
-                    "data": {
-                        "source": selected_control.id,
-                        "target": relevant_document_id,
-                    }
-                }
-            )
-
-    return elements
-
-
 DASH_STYLESHEET = [
     {
         "selector": "node",
@@ -93,43 +54,54 @@ DASH_STYLESHEET = [
 ]
 
 
+# The graph and the layout tree are built once, update_layout only sets the elements
+GRAPH = cyto.Cytoscape(
+    id="cytoscape-graph",
+    elements=[],
+    layout={"name": "cose"},  # Force-directed layout
+    style={"width": "100%", "height": "2500px"},
+    stylesheet=DASH_STYLESHEET,
+)
+
+LAYOUT = html.Div(
+    [
+        html.Div(
+            [
+                html.Table(
+                    [
+                        html.Tr(
+                            [
+                                html.Td(
+                                    "ISO 27001 Documents Mapping",
+                                    style={
+                                        "font-size": "30px",
+                                        "font-weight": "bold",
+                                    },
+                                )
+                            ]
+                        ),
+                        html.Tr(
+                            [
+                                html.Td("Keywords:"),
+                                dcc.Input(
+                                    id="input-keywords",
+                                    type="text",
+                                    size="150",
+                                    # Filter on Enter or blur, not on every keystroke
+                                    debounce=True,
+                                ),
+                            ]
+                        ),
+                    ],
+                    style={"font-size": "20px", "font-weight": "bold"},
+                ),
+            ]
+        ),
+        GRAPH,
+    ]
+)
+
+
 def update_layout(app, elements):
-    app.layout = html.Div(
-        [
-            html.Div(
-                [
-                    html.Table(
-                        [
-                            html.Tr(
-                                [
-                                    html.Td(
-                                        "ISO 27001 Documents Mapping",
-                                        style={
-                                            "font-size": "30px",
-                                            "font-weight": "bold",
-                                        },
-                                    )
-                                ]
-                            ),
-                            html.Tr(
-                                [
-                                    html.Td("Keywords:"),
-                                    dcc.Input(
-                                        id="input-keywords", type="text", size="150"
-                                    ),
-                                ]
-                            ),
-                        ],
-                        style={"font-size": "20px", "font-weight": "bold"},
-                    ),
-                ]
-            ),
-            cyto.Cytoscape(
-                id="cytoscape-graph",
-                elements=elements,
-                layout={"name": "cose"},  # Force-directed layout
-                style={"width": "100%", "height": "2500px"},
-                stylesheet=DASH_STYLESHEET,
-            ),
-        ]
-    )
+    GRAPH.elements = elements
+    app.layout = LAYOUT
@@ -1,13 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
 from pathlib import Path
-from typing import List, Set
+from typing import Iterable, List, Optional, Set
+import mmap
+import os
 import re
 
-from documents import load_documents, Document
+from app.visual.documents import Document, MAX_WORKERS
+
+__all__ = [
+    "SelectedControl",
+    "extract_document_ids_from_content",
+    "load_selected_controls",
+]
+
+# Pattern to match /pages/{id} in Confluence URLs, matched against the raw file bytes
+_PAGES_RE = re.compile(rb"/pages/(\d+)")
+
+# Pattern to match filenames starting with a control ID (e.g., "5.1", "8.2")
+# Format: {number}.{number} {rest of name}.md
+_CONTROL_FILENAME_RE = re.compile(r"^(\d+\.\d+)\s+(.+?)\.md$")
+
+# Files (lowercase) in the selected documents directory that are not controls
+_SKIP_FILES = frozenset({"template.md"})
 
 
 class SelectedControl:
     """Model representing a selected control with its relevant documents."""
 
+    __slots__ = ("id", "name", "relevant_document_ids", "_sort_key")
+
     def __init__(self, id: str, name: str, relevant_document_ids: List[str]):
         """
         Initialize a SelectedControl object.
@@ -19,6 +41,8 @@ class SelectedControl:
         """
         self.id = id
         self.name = name
+        # Numeric sort key parsed once, e.g. "8.12" -> (8, 12)
+        self._sort_key = tuple(int(part) for part in id.split("."))
         self.relevant_document_ids = relevant_document_ids
 
     def __repr__(self):
@@ -26,48 +50,81 @@ class SelectedControl:
 
 
 def extract_document_ids_from_content(
-    content: str, available_document_ids: Set[str]
+    path: Path, available_document_ids: Set[bytes]
 ) -> List[str]:
     """
-    Extract document IDs from Confluence URLs in the content.
+    Extract document IDs from Confluence URLs in a file.
+
+    The file is memory-mapped and scanned as bytes, so it is never decoded as a whole.
 
     Args:
-        content: The content string to search for document IDs
-        available_document_ids: Set of available document IDs to filter against
+        path: Path to the file to search for document IDs
+        available_document_ids: Set of available document IDs (UTF-8 encoded) to filter against
 
     Returns:
-        List of unique document IDs found in the content that exist in available documents
+        List of unique document IDs found in the file that exist in available documents
     """
-    # Pattern to match /pages/{id} in Confluence URLs
-    pattern = re.compile(r"/pages/(\d+)")
-
-    # Find all matches in the content
-    matches = pattern.findall(content)
-
-    # Convert to set to remove duplicates, then filter to only include available IDs
-    found_ids = set(matches)
-    relevant_ids = [doc_id for doc_id in found_ids if doc_id in available_document_ids]
+    with open(path, "rb") as f:
+        # mmap cannot map an empty file
+        if not f.seek(0, 2):
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            found_ids = set(_PAGES_RE.findall(mm))
+
+    # Filter to only include available IDs and sort for consistency
+    return [
+        doc_id.decode("ascii")
+        for doc_id in sorted(found_ids & available_document_ids, key=int)
+    ]
+
+
+def _load_selected_control(
+    file_path: Path,
+    control_id: str,
+    control_name: str,
+    available_document_ids: Set[bytes],
+) -> Optional[SelectedControl]:
+    """
+    Create a SelectedControl from a file, mapping it to the documents it references.
 
-    # Sort for consistency
-    relevant_ids.sort(key=lambda x: int(x))
+    Args:
+        file_path: Path to the selected control file
+        control_id: The control ID taken from the filename
+        control_name: The control name taken from the filename
+        available_document_ids: Set of available document IDs (UTF-8 encoded)
 
-    return relevant_ids
+    Returns:
+        SelectedControl object, or None if the file could not be read
+    """
+    try:
+        # Extract document IDs from the file content
+        relevant_document_ids = extract_document_ids_from_content(
+            file_path, available_document_ids
+        )
+    except Exception as e:
+        print(f"Warning: Could not read file {file_path.name}: {e}")
+        return None
+
+    return SelectedControl(
+        id=control_id,
+        name=control_name,
+        relevant_document_ids=relevant_document_ids,
+    )
 
 
 def load_selected_controls(
-    selected_documents_dir: str, documents: List[Document]
+    selected_documents_dir: str, documents: Iterable[Document]
 ) -> List[SelectedControl]:
     """
     Load selected controls from the specified directory and map them to relevant documents.
 
     Args:
         selected_documents_dir: Path to the directory containing selected control files
-        documents: List of available Document objects
+        documents: Available Document objects (e.g. the DocumentIndex from load_documents)
 
     Returns:
         List of SelectedControl objects with mapped document IDs
     """
-    selected_controls = []
     selected_documents_path = Path(selected_documents_dir)
 
     if not selected_documents_path.exists():
@@ -75,55 +132,49 @@ def load_selected_controls(
             f"Selected documents directory not found: {selected_documents_dir}"
         )
 
-    # Create a set of available document IDs for fast lookup
-    available_document_ids = {doc.id for doc in documents}
-
-    # Pattern to match filenames starting with a control ID (e.g., "5.1", "8.2")
-    # Format: {number}.{number} {rest of name}.md
-    pattern = re.compile(r"^(\d+\.\d+)\s+(.+?)\.md$")
+    # Create a set of available document IDs for fast lookup, encoded once to match raw bytes
+    available_document_ids = {doc.id.encode("utf-8") for doc in documents}
 
     # Iterate through all .md files in the directory
-    for file_path in selected_documents_path.glob("*.md"):
-        filename = file_path.name
-
-        # Skip template.md file
-        if filename.lower() == "template.md":
-            continue
-
-        match = pattern.match(filename)
-
-        if match:
-            control_id = match.group(1)
-            control_name = match.group(2)
-
-            # Read the file content
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-
-                # Extract document IDs from the content
-                relevant_document_ids = extract_document_ids_from_content(
-                    content, available_document_ids
-                )
-
-                selected_control = SelectedControl(
-                    id=control_id,
-                    name=control_name,
-                    relevant_document_ids=relevant_document_ids,
+    matched_files = []
+    with os.scandir(selected_documents_path) as entries:
+        for entry in entries:
+            filename = entry.name
+            # Visible markdown files, as matched by Path.glob("*.md")
+            if (
+                not filename.endswith(".md")
+                or filename.startswith(".")
+                or not entry.is_file()
+            ):
+                continue
+
+            # Skip template.md and other non-control files
+            if filename.lower() in _SKIP_FILES:
+                continue
+
+            match = _CONTROL_FILENAME_RE.match(filename)
+
+            if match:
+                matched_files.append(
+                    (Path(entry.path), match.group(1), match.group(2))
                 )
-                selected_controls.append(selected_control)
-            except Exception as e:
-                print(f"Warning: Could not read file {filename}: {e}")
-        else:
-            # Only warn if it's not template.md (already skipped)
-            if filename.lower() != "template.md":
+            else:
                 print(
                     f"Warning: Filename '{filename}' does not match expected pattern (ID Name.md)"
                 )
 
+    # Scan the files in parallel, the threads release the GIL while waiting on disk
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        selected_controls = [
+            selected_control
+            for selected_control in executor.map(
+                lambda args: _load_selected_control(*args, available_document_ids),
+                matched_files,
+            )
+            if selected_control is not None
+        ]
+
     # Sort controls by ID for consistency
-    selected_controls.sort(
-        key=lambda x: (float(x.id.split(".")[0]), float(x.id.split(".")[1]))
-    )
+    selected_controls.sort(key=attrgetter("_sort_key"))
 
     return selected_controls
@@ -1,8 +1,9 @@
 #!/bin/bash
 
 # Script to select documents for a given ISO 27001 control
-# Usage: ./select_documents.sh <control_id>
+# Usage: ./select_documents.sh <control_id> [<control_id> ...] [--batch-size N]
 # Example: ./select_documents.sh 5.2
+# Example: ./select_documents.sh 5.1 5.2 5.3 --batch-size 3
 
 # Check if control number is provided
 if [ -z "$1" ]; then
@@ -12,7 +13,6 @@ if [ -z "$1" ]; then
     exit 1
 fi
 
-CONTROL_ID="$1"
 SCRIPT_DIR="/Users/andrzejkowal/projects/ISO-21-document-mapping-maching-agent"
 VENV_PYTHON="${SCRIPT_DIR}/.venv/bin/python"
 PYTHON_SCRIPT="${SCRIPT_DIR}/app/selector/execute_control.py"
@@ -35,6 +35,6 @@ cd "$SCRIPT_DIR" || exit 1
 # Add main project directory to Python path
 export PYTHONPATH="${SCRIPT_DIR}:${PYTHONPATH}"
 
-# Execute the Python script with the control ID
-"$VENV_PYTHON" "$PYTHON_SCRIPT" "$CONTROL_ID"
+# Execute the Python script with the control IDs
+"$VENV_PYTHON" "$PYTHON_SCRIPT" "$@"
 